@@ -0,0 +1,96 @@
+"""
+Compares ingesting cases through `/cases/bulk` against one `/cases/add_case` request per case.
+
+The real app is driven in-process over ASGI, so the numbers include routing, validation and serialization but not the
+network. A patient is created for every `--patients` cases and the case emails are spread across them. They are
+written into DB_NAME, which has to contain "bench" unless `--any-db` is given.
+
+Usage:
+    CONNECTION_STRING=mongodb://localhost:27017 DB_NAME=bench JWT_SECRET_KEY=bench \
+        python -m benchmarks.bulk_ingestion --cases 100000 --concurrency 32
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from benchmarks import seed
+from main import app
+
+
+def make_cases(count, patients):
+    return [{
+        "first_name": "John",
+        "last_name": "Doe",
+        "email": f"patient{i % patients}@gmail.com",
+        "category": "heart",
+        "status": "active",
+        "created_date": "2023-05-01T00:00:00",
+    } for i in range(count)]
+
+
+async def login(client, patients):
+    for i in range(patients):
+        await client.post("/user-auth/signup", json={
+            "email": f"patient{i}@gmail.com", "password": "password", "firstname": "John", "lastname": "Doe",
+        })
+    response = await client.post("/user-auth/login", data={"username": "patient0@gmail.com", "password": "password"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def run_single(client, headers, cases, concurrency):
+    queue = list(cases)
+
+    async def worker():
+        while queue:
+            response = await client.post("/cases/add_case", headers=headers, json=queue.pop())
+            response.raise_for_status()
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def run_bulk(client, headers, cases, batch):
+    for start in range(0, len(cases), batch):
+        body = "\n".join(json.dumps(case) for case in cases[start:start + batch])
+        response = await client.post("/cases/bulk", content=body,
+                                     headers={**headers, "Content-Type": "application/x-ndjson"})
+        response.raise_for_status()
+
+
+async def main(args):
+    seed.check_benchmark_target(args.any_db)
+    cases = make_cases(args.cases, args.patients)
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app), \
+            httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        headers = await login(client, args.patients)
+
+        start = time.perf_counter()
+        await run_single(client, headers, cases, args.concurrency)
+        single = time.perf_counter() - start
+
+        start = time.perf_counter()
+        await run_bulk(client, headers, cases, args.batch)
+        bulk = time.perf_counter() - start
+
+    print(json.dumps({
+        "cases": args.cases,
+        "single_seconds": round(single, 3),
+        "single_cases_per_second": round(args.cases / single, 1),
+        "bulk_seconds": round(bulk, 3),
+        "bulk_cases_per_second": round(args.cases / bulk, 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", type=int, default=100000)
+    parser.add_argument("--patients", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=32, help="in-flight add_case requests")
+    parser.add_argument("--batch", type=int, default=10000, help="cases per /cases/bulk request")
+    parser.add_argument("--any-db", action="store_true",
+                        help="allow a DB_NAME that does not contain 'bench', the benchmark writes into it")
+    asyncio.run(main(parser.parse_args()))
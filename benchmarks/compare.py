@@ -0,0 +1,45 @@
+"""
+Compares two reports of `benchmarks.load`, e.g. from the base and the head commit of a change.
+
+A scenario regresses when its p95 latency grows, or its throughput drops, by more than `--threshold` (a fraction).
+The exit status is 1 when any scenario regresses.
+
+Usage:
+    python -m benchmarks.compare base.json head.json --threshold 0.1
+"""
+
+import argparse
+import json
+import sys
+
+
+def change(base, head):
+    return (head - base) / base if base else 0.0
+
+
+def main(args):
+    with open(args.base) as file:
+        base = json.load(file)
+    with open(args.head) as file:
+        head = json.load(file)
+
+    regressed = False
+    print(f"{'scenario':<16}{'rps base':>12}{'rps head':>12}{'p95 base':>12}{'p95 head':>12}  verdict")
+    for scenario, head_result in head["scenarios"].items():
+        base_result = base["scenarios"].get(scenario)
+        if base_result is None:
+            continue
+        slower = change(base_result["p95_ms"], head_result["p95_ms"]) > args.threshold
+        fewer = change(base_result["throughput_rps"], head_result["throughput_rps"]) < -args.threshold
+        regressed |= slower or fewer
+        print(f"{scenario:<16}{base_result['throughput_rps']:>12}{head_result['throughput_rps']:>12}"
+              f"{base_result['p95_ms']:>12}{head_result['p95_ms']:>12}  {'REGRESSED' if slower or fewer else 'ok'}")
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    sys.exit(main(parser.parse_args()))
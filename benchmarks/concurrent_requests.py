@@ -0,0 +1,83 @@
+"""
+Measures how throughput of concurrent database lookups scales with the number of in-flight requests.
+
+The same `find_one({"email": ...})` lookup used by the drivers is issued from `--concurrency` coroutines on one event
+loop, once through blocking pymongo (what the drivers used to do) and once through the async Motor driver layer.
+With pymongo every lookup stalls the loop, so throughput stays flat as concurrency grows; with Motor the lookups
+overlap and throughput rises until the server or the pool saturates. Missing lookup users are added to DB_NAME, which
+has to contain "bench" unless `--any-db` is given.
+
+Usage:
+    CONNECTION_STRING=mongodb://localhost:27017 DB_NAME=bench python -m benchmarks.concurrent_requests \
+        --requests 2000 --concurrency 1 8 32 128
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from pymongo import MongoClient
+
+from benchmarks import seed
+from dependencies.db.users import UsersDriver
+
+
+async def run_blocking(collection, emails, concurrency):
+    queue = list(emails)
+
+    async def worker():
+        while queue:
+            collection.find_one({"email": queue.pop()})
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def run_async(driver, emails, concurrency):
+    queue = list(emails)
+
+    async def worker():
+        while queue:
+            await driver.email_exists(queue.pop())
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def measure(runner, target, emails, concurrency):
+    start = time.perf_counter()
+    await runner(target, emails, concurrency)
+    elapsed = time.perf_counter() - start
+    return len(emails) / elapsed
+
+
+async def main(args):
+    seed.check_benchmark_target(args.any_db)
+    sync_collection = MongoClient(os.environ.get("CONNECTION_STRING"))[os.environ.get("DB_NAME")]["users"]
+    driver = UsersDriver()
+    emails = [f"bench{i % args.users}@example.com" for i in range(args.requests)]
+
+    if sync_collection.estimated_document_count() < args.users:
+        sync_collection.insert_many(
+            [{"email": f"bench{i}@example.com", "password": "x", "firstname": "a", "lastname": "b", "cases": []}
+             for i in range(args.users)]
+        )
+
+    results = []
+    for concurrency in args.concurrency:
+        results.append({
+            "concurrency": concurrency,
+            "blocking_rps": round(await measure(run_blocking, sync_collection, emails, concurrency), 1),
+            "async_rps": round(await measure(run_async, driver, emails, concurrency), 1),
+        })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--any-db", action="store_true",
+                        help="allow a DB_NAME that does not contain 'bench', the benchmark writes into it")
+    asyncio.run(main(parser.parse_args()))
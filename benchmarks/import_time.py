@@ -0,0 +1,50 @@
+"""
+Checks the cold start of a worker: importing `main` must stay under a time budget and must not create the database
+client or any driver, which the lifespan hook does once the worker is running.
+
+Every run imports `main` in a fresh interpreter; the median of `--runs` runs is compared with the budget. The exit
+status is 1 when the budget is exceeded or the import connected to the database, so it can gate CI.
+
+Usage:
+    python -m benchmarks.import_time --runs 5 --budget-ms 1500
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+_probe = """
+import time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+from dependencies.db.client import Client
+print(elapsed, Client._instance is not None)
+"""
+
+
+def measure():
+    output = subprocess.run([sys.executable, "-c", _probe], capture_output=True, text=True, check=True).stdout
+    elapsed, connected = output.split()
+    return float(elapsed) * 1000, connected == "True"
+
+
+def main(args):
+    runs = [measure() for _ in range(args.runs)]
+    median_ms = statistics.median(elapsed for elapsed, _ in runs)
+    connected = any(connected for _, connected in runs)
+    print(json.dumps({
+        "median_ms": round(median_ms, 1),
+        "budget_ms": args.budget_ms,
+        "client_created_at_import": connected,
+    }, indent=2))
+    return 0 if median_ms <= args.budget_ms and not connected else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=1500)
+    sys.exit(main(parser.parse_args()))
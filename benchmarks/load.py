@@ -0,0 +1,196 @@
+"""
+Load test of the API: signup, login, add_case and display-cases driven by concurrent clients, reported as JSON.
+`display_cases_revalidate` repeats the display-cases request with the ETag of the current page, as a polling client
+does, so it measures the 304 path.
+
+The real FastAPI app is driven in-process over ASGI (or a running server with `--base-url`) against the database of
+CONNECTION_STRING/DB_NAME, or against an in-process stand-in with `--in-process` (needs `mongomock-motor`). The
+stand-in is always seeded with `benchmarks.seed`. A real database is only seeded with `--reset`, which deletes its
+users, organizations and cases and is refused unless DB_NAME contains "bench"; without it the run uses the data
+already there, e.g. from an earlier `python -m benchmarks.seed --reset`. The run itself signs users up and adds cases,
+so it is also refused against a DB_NAME without "bench" unless `--any-db` is given; with `--base-url`, DB_NAME has to
+name the database of that server.
+
+Every scenario sends `--requests` requests from `--concurrency` clients and reports throughput, error count and
+p50/p95/p99 latency. The report also records the git commit, so two reports can be compared with
+`python -m benchmarks.compare`.
+
+Login limits are raised for the run and email deliverability (DNS) checks are off unless `--dns` is given, so the
+numbers measure the app rather than the rate limiter or the resolver.
+
+Usage:
+    CONNECTION_STRING=mongodb://localhost:27017 DB_NAME=bench JWT_SECRET_KEY=bench \
+        python -m benchmarks.load --reset --users 10000 --cases 1000000 --requests 2000 --concurrency 64 \
+        --output head.json
+    python -m benchmarks.load --in-process --users 1000 --cases 10000 --output head.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import time
+from datetime import datetime
+
+import httpx
+
+from benchmarks import seed
+from dependencies.models.cases import Category
+
+SCENARIOS = ["signup", "login", "add_case", "display_cases", "display_cases_revalidate"]
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize(latencies, errors, elapsed):
+    percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentiles[49] * 1000, 2),
+        "p95_ms": round(percentiles[94] * 1000, 2),
+        "p99_ms": round(percentiles[98] * 1000, 2),
+    }
+
+
+async def run_scenario(make_request, requests, concurrency):
+    remaining = iter(range(requests))
+    latencies = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for index in remaining:
+            start = time.perf_counter()
+            response = await make_request(index)
+            latencies.append(time.perf_counter() - start)
+            errors += response.status_code >= 400
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def login(client, path, email):
+    response = await client.post(path, data={"username": email, "password": seed.PASSWORD})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def run(client, args):
+    rng = random.Random(args.seed)
+    run_id = int(time.time())
+    user_headers = await login(client, "/user-auth/login", seed.user_email(0))
+    org_headers = await login(client, "/org-auth/org-login", seed.org_email(0))
+    categories = [category.value for category in Category]
+
+    def signup(index):
+        return client.post("/user-auth/signup", json={
+            "email": f"load{run_id}-{index}@gmail.com", "password": seed.PASSWORD,
+            "firstname": "John", "lastname": "Doe",
+        })
+
+    def login_request(index):
+        return client.post("/user-auth/login", data={
+            "username": seed.user_email(rng.randrange(args.users)), "password": seed.PASSWORD,
+        })
+
+    def add_case(index):
+        return client.post("/cases/add_case", headers=user_headers, json={
+            "first_name": "John", "last_name": "Doe", "email": seed.user_email(rng.randrange(args.users)),
+            "category": rng.choice(categories), "status": "active", "created_date": datetime.utcnow().isoformat(),
+        })
+
+    def display_cases(index):
+        return client.get("/cases/display-cases", headers=org_headers, params={"size": args.page_size})
+
+    revalidate_headers = {}
+
+    def display_cases_revalidate(index):
+        return client.get("/cases/display-cases", headers=revalidate_headers, params={"size": args.page_size})
+
+    requests = {"signup": signup, "login": login_request, "add_case": add_case, "display_cases": display_cases,
+                "display_cases_revalidate": display_cases_revalidate}
+    results = {}
+    for scenario in args.scenarios:
+        if scenario == "display_cases_revalidate":
+            etag = (await display_cases(0)).headers.get("etag", "")
+            revalidate_headers.update(org_headers, **{"If-None-Match": etag})
+        results[scenario] = await run_scenario(requests[scenario], args.requests, args.concurrency)
+    return results
+
+
+async def main(args):
+    os.environ.setdefault("LOGIN_IP_BURST", "1000000000")
+    os.environ.setdefault("LOGIN_IP_PER_MINUTE", "1000000000")
+    os.environ.setdefault("LOGIN_EMAIL_BURST", "1000000000")
+    os.environ.setdefault("LOGIN_EMAIL_PER_MINUTE", "1000000000")
+    if not args.dns:
+        import email_validator
+        email_validator.CHECK_DELIVERABILITY = False
+    if args.in_process:
+        from mongomock_motor import AsyncMongoMockClient
+        from dependencies.db.client import Client
+        os.environ.setdefault("DB_NAME", "bench")
+        # the stand-in has no replica set, hence no change streams
+        os.environ.setdefault("CASE_FEED_SOURCE", "local")
+        Client(AsyncMongoMockClient())
+
+    if not args.in_process:
+        seed.check_benchmark_target(args.any_db)
+    if args.in_process or args.reset:
+        await seed.seed(args.users, 1, args.cases, random_seed=args.seed, in_process=args.in_process)
+
+    if args.base_url:
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=None) as client:
+            results = await run(client, args)
+    else:
+        from main import app
+        transport = httpx.ASGITransport(app=app)
+        async with app.router.lifespan_context(app), \
+                httpx.AsyncClient(transport=transport, base_url="http://load", timeout=None) as client:
+            results = await run(client, args)
+
+    report = {
+        "commit": git_commit(),
+        "date": datetime.utcnow().isoformat(),
+        "parameters": {
+            "users": args.users, "cases": args.cases, "requests": args.requests, "concurrency": args.concurrency,
+            "page_size": args.page_size, "in_process": args.in_process, "base_url": args.base_url,
+        },
+        "scenarios": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--cases", type=int, default=100000)
+    parser.add_argument("--requests", type=int, default=1000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--in-process", action="store_true", help="use an in-process stand-in for MongoDB")
+    parser.add_argument("--reset", action="store_true",
+                        help="seed the database first, deleting its users, organizations and cases")
+    parser.add_argument("--base-url", help="load a running server instead of the app in-process")
+    parser.add_argument("--any-db", action="store_true",
+                        help="allow a DB_NAME that does not contain 'bench', the benchmark writes into it")
+    parser.add_argument("--dns", action="store_true", help="keep the email deliverability (DNS) check on login")
+    parser.add_argument("--output", help="also write the report to this file")
+    asyncio.run(main(parser.parse_args()))
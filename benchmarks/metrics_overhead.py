@@ -0,0 +1,69 @@
+"""
+Measures what recording metrics adds to the hot path: one `Histogram.observe` call, and one request through
+`MetricsMiddleware` compared with the same request without it.
+
+Requests are sent straight to the ASGI app, with no server or HTTP client, so the middleware cost is not hidden
+behind network time.
+
+Usage:
+    python -m benchmarks.metrics_overhead --iterations 100000
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import timeit
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+
+from dependencies import metrics
+
+
+def make_app(with_metrics):
+    app = FastAPI()
+
+    @app.get("/cases/{case_id}")
+    async def endpoint(case_id: str):
+        return PlainTextResponse(case_id)
+
+    if with_metrics:
+        app.add_middleware(metrics.MetricsMiddleware)
+    return app
+
+
+async def requests_per_second(app, iterations):
+    scope = {"type": "http", "method": "GET", "path": "/cases/1", "raw_path": b"/cases/1", "query_string": b"",
+             "headers": [], "root_path": "", "scheme": "http", "server": ("bench", 80), "http_version": "1.1"}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    await app(dict(scope), receive, send)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - start) / iterations
+
+
+def main(args):
+    histogram = metrics.Histogram("bench_seconds", "benchmark", ("label",))
+    observe = timeit.timeit(lambda: histogram.observe(0.003, "value"), number=args.iterations) / args.iterations
+    without = asyncio.run(requests_per_second(make_app(False), args.iterations // 10))
+    with_metrics = asyncio.run(requests_per_second(make_app(True), args.iterations // 10))
+    print(json.dumps({
+        "observe_us": round(observe * 1e6, 3),
+        "request_without_metrics_us": round(without * 1e6, 1),
+        "request_with_metrics_us": round(with_metrics * 1e6, 1),
+        "middleware_overhead_us": round((with_metrics - without) * 1e6, 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=100000)
+    main(parser.parse_args())
@@ -0,0 +1,53 @@
+"""
+Measures the BSON-decode cost of the user reads with and without the projections used by the drivers.
+
+A user document with `--cases` embedded case summaries is encoded once, then decoded `--iterations` times in full (what
+`find_one({"email": ...})` used to return) and as each projected shape: the `_id` existence probe and the login
+credentials fetch.
+
+Usage:
+    python -m benchmarks.projection_decode --cases 50 --iterations 100000
+"""
+
+import argparse
+import json
+import timeit
+from datetime import datetime
+
+import bson
+from bson.objectid import ObjectId
+
+
+def make_user(cases):
+    return {
+        "_id": ObjectId(),
+        "email": "patient@gmail.com",
+        "password": "$2b$12$" + "x" * 53,
+        "firstname": "John",
+        "lastname": "Doe",
+        "last_password_update": datetime(2023, 5, 1),
+        "cases": [{"case_id": str(ObjectId()), "category": "heart", "status": "active", "severity": 1}
+                  for _ in range(cases)],
+    }
+
+
+def main(args):
+    user = make_user(args.cases)
+    shapes = {
+        "full": user,
+        "exists_probe": {"_id": user["_id"]},
+        "credentials": {"_id": user["_id"], "email": user["email"], "password": user["password"]},
+    }
+    results = {}
+    for name, doc in shapes.items():
+        raw = bson.encode(doc)
+        seconds = timeit.timeit(lambda: bson.decode(raw), number=args.iterations)
+        results[name] = {"bytes": len(raw), "decode_us": round(seconds / args.iterations * 1e6, 3)}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", type=int, default=50)
+    parser.add_argument("--iterations", type=int, default=100000)
+    main(parser.parse_args())
@@ -0,0 +1,139 @@
+"""
+Throughput of `serve.py` as the number of worker processes grows, to check that the API scales from 1 to N cores.
+
+For every worker count in `--workers`, the server is started on a local port and waited for with `GET /ready`, then
+`--clients` processes of `benchmarks.load` send the `--scenario` requests at the same time (one Python load process
+tops out well below what several workers serve, so it takes several to load them) and their throughput is summed.
+The report gives throughput, latency and the speed-up and efficiency relative to one worker.
+
+With `--reset` the database of CONNECTION_STRING/DB_NAME is first seeded with `benchmarks.seed`, which deletes its
+users, organizations and cases and is refused unless DB_NAME contains "bench"; otherwise its data is used as is. Leave
+at least one core to the load processes, or run them from another host with `benchmarks.load --base-url`. The load
+processes write into DB_NAME, so it has to contain "bench" unless `--any-db` is given.
+
+Usage:
+    CONNECTION_STRING=mongodb://localhost:27017 DB_NAME=bench JWT_SECRET_KEY=bench \
+        python -m benchmarks.scaling --reset --workers 1 2 4 8 --scenario display_cases --output scaling.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+
+from benchmarks import seed
+from benchmarks.load import SCENARIOS
+from benchmarks.load import git_commit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_ready(base_url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{base_url}/ready").status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"the server at {base_url} did not become ready in {timeout} s")
+
+
+def run_load(base_url: str, args) -> dict:
+    """
+    Runs `args.clients` load processes against the server at once and merges their reports.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        outputs = [os.path.join(directory, f"client{i}.json") for i in range(args.clients)]
+        processes = [subprocess.Popen([
+            sys.executable, "-m", "benchmarks.load", "--base-url", base_url,
+            "--users", str(args.users), "--scenarios", args.scenario, "--requests", str(args.requests),
+            "--concurrency", str(args.concurrency), "--seed", str(i), "--output", output,
+            *(["--any-db"] if args.any_db else []),
+        ], cwd=ROOT, stdout=subprocess.DEVNULL) for i, output in enumerate(outputs)]
+        for process in processes:
+            if process.wait():
+                raise RuntimeError("a load process failed")
+        results = []
+        for output in outputs:
+            with open(output) as file:
+                results.append(json.load(file)["scenarios"][args.scenario])
+    return {
+        "requests": sum(result["requests"] for result in results),
+        "errors": sum(result["errors"] for result in results),
+        "throughput_rps": round(sum(result["throughput_rps"] for result in results), 1),
+        "p50_ms": round(sum(result["p50_ms"] for result in results) / len(results), 2),
+        "p99_ms": max(result["p99_ms"] for result in results),
+    }
+
+
+def measure(workers: int, args) -> dict:
+    base_url = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen([
+        sys.executable, "serve.py", "--workers", str(workers), "--bind", f"127.0.0.1:{args.port}", "--preload",
+    ], cwd=ROOT, env={
+        **os.environ,
+        "LOGIN_IP_BURST": "1000000000", "LOGIN_IP_PER_MINUTE": "1000000000",
+        "LOGIN_EMAIL_BURST": "1000000000", "LOGIN_EMAIL_PER_MINUTE": "1000000000",
+    }, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(base_url)
+        return {"workers": workers, **run_load(base_url, args)}
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main(args):
+    seed.check_benchmark_target(args.any_db)
+    if args.reset:
+        asyncio.run(seed.seed(args.users, 1, args.cases))
+
+    runs = [measure(workers, args) for workers in args.workers]
+    baseline = runs[0]["throughput_rps"] / runs[0]["workers"] or 1
+    for run in runs:
+        run["speedup"] = round(run["throughput_rps"] / baseline, 2)
+        run["efficiency"] = round(run["speedup"] / run["workers"], 2)
+
+    report = {
+        "commit": git_commit(),
+        "date": datetime.utcnow().isoformat(),
+        "parameters": {
+            "scenario": args.scenario, "users": args.users, "cases": args.cases, "clients": args.clients,
+            "requests": args.requests, "concurrency": args.concurrency, "cpu_count": os.cpu_count(),
+        },
+        "runs": runs,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    cpu_count = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted({cpu_count, *(2 ** i for i in range(cpu_count.bit_length()))}))
+    parser.add_argument("--scenario", choices=SCENARIOS, default="display_cases")
+    parser.add_argument("--clients", type=int, default=max(1, cpu_count // 2), help="load processes per run")
+    parser.add_argument("--requests", type=int, default=1000, help="requests per load process")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent requests per load process")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--cases", type=int, default=100000)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--reset", action="store_true",
+                        help="seed the database first, deleting its users, organizations and cases")
+    parser.add_argument("--output", help="also write the report to this file")
+    parser.add_argument("--any-db", action="store_true",
+                        help="allow a DB_NAME that does not contain 'bench', the benchmark writes into it")
+    main(parser.parse_args())
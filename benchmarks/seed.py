@@ -0,0 +1,115 @@
+"""
+Seeds the database with users, organizations and cases for the benchmarks.
+
+Seeding replaces the users, organizations, cases and case counters of the database, so it has to be confirmed with
+`--reset`, and only databases whose name contains "bench" are reset (the in-process stand-in of `benchmarks.load` is
+always allowed).
+
+Users are written directly with one precomputed bcrypt hash of `PASSWORD`, so seeding 10k users does not cost 10k
+hashes, and cases go through `CasesDriver.insert_cases` so the case counters are kept in step. Emails are
+deterministic (`user<i>@gmail.com`, `org<i>@gmail.com`) so a load run can log in as any seeded account.
+
+Usage:
+    CONNECTION_STRING=mongodb://localhost:27017 DB_NAME=bench python -m benchmarks.seed --reset \
+        --users 10000 --cases 1000000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+from datetime import datetime
+from datetime import timedelta
+
+from bson.objectid import ObjectId
+
+from dependencies.db.cases import CasesDriver
+from dependencies.db.client import Client
+from dependencies.db.indexes import create_indexes
+from dependencies.models.cases import Category
+from routers.auth.password_handler import PasswordHandler
+
+PASSWORD = "password"
+STATUSES = ["active", "closed", "pending"]
+
+
+def user_email(index):
+    return f"user{index}@gmail.com"
+
+
+def org_email(index):
+    return f"org{index}@gmail.com"
+
+
+def check_benchmark_target(any_db: bool = False):
+    """
+    Refuses to go on unless DB_NAME is a benchmark database or `any_db` confirms that writing benchmark users, cases
+    and organizations into it is wanted. Every benchmark that writes calls this, not only the ones that reset.
+    """
+    name = os.environ.get("DB_NAME") or ""
+    if not any_db and "bench" not in name.lower():
+        raise SystemExit(f"refusing to run against the database {name!r}: benchmarks add users, organizations and "
+                         f"cases, use a database whose name contains 'bench' or pass --any-db")
+
+
+def check_reset_target(in_process: bool = False):
+    """
+    Refuses to go on unless DB_NAME is a benchmark database or the database is the in-process stand-in.
+    """
+    name = os.environ.get("DB_NAME") or ""
+    if not in_process and "bench" not in name.lower():
+        raise SystemExit(f"refusing to reset the database {name!r}: seeding deletes its users, organizations and "
+                         f"cases, use a database whose name contains 'bench'")
+
+
+async def seed(users: int, orgs: int, cases: int, batch: int = 10000, random_seed: int = 0, in_process: bool = False):
+    """
+    Replaces the users, organizations, cases and case counters of the database with generated ones.
+    """
+    check_reset_target(in_process)
+    db = Client.get_instance().get_db()
+    await create_indexes(db)
+    rng = random.Random(random_seed)
+    password_hash = PasswordHandler().pwd_context.hash(PASSWORD)
+    now = datetime(2023, 5, 1)
+
+    for collection, count, email in (("users", users, user_email), ("organizations", orgs, org_email)):
+        await db[collection].delete_many({})
+        for start in range(0, count, batch):
+            await db[collection].insert_many([{
+                "email": email(i),
+                "password": password_hash,
+                "firstname": "John",
+                "lastname": "Doe",
+                "last_password_update": now,
+                "cases": [],
+            } for i in range(start, min(count, start + batch))])
+
+    await db["cases"].delete_many({})
+    await db["case_counters"].delete_many({})
+    cases_driver = CasesDriver()
+    categories = [category.value for category in Category]
+    for start in range(0, cases, batch):
+        await cases_driver.insert_cases([{
+            "_id": ObjectId(),
+            "first_name": "John",
+            "last_name": "Doe",
+            "email": user_email(rng.randrange(max(users, 1))),
+            "category": rng.choice(categories),
+            "status": rng.choice(STATUSES),
+            "created_date": now - timedelta(minutes=rng.randrange(525600)),
+        } for _ in range(start, min(cases, start + batch))])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--orgs", type=int, default=10)
+    parser.add_argument("--cases", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the generated cases")
+    parser.add_argument("--reset", action="store_true",
+                        help="confirm that the users, organizations and cases of DB_NAME are deleted")
+    args = parser.parse_args()
+    if not args.reset:
+        parser.error("seeding deletes the users, organizations and cases of DB_NAME, pass --reset to confirm")
+    asyncio.run(seed(args.users, args.orgs, args.cases, random_seed=args.seed))
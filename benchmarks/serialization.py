@@ -0,0 +1,94 @@
+"""
+Compares the default and the fast (`FAST_JSON_RESPONSES=1`) serialization of case listings, without a database.
+
+For every size the same documents are turned into response bodies, in pages of `--page-size` for
+`/cases/display-cases` and line by line for `/cases/display-cases/stream`:
+    - default: `CaseOut` validation, `response_model` validation, `jsonable_encoder` and stdlib json
+    - fast: `CasesDriver.case_out_dict` and orjson
+
+Usage:
+    python -m benchmarks.serialization --cases 10000 100000
+"""
+
+import argparse
+import json
+import time
+from datetime import datetime
+from datetime import timedelta
+
+import orjson
+from bson.objectid import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
+from fastapi_pagination.cursor import CursorPage
+from fastapi_pagination.cursor import CursorParams
+
+from dependencies.db.cases import CasesDriver
+from dependencies.models.cases import CaseOut
+
+
+def make_docs(count):
+    start = datetime(2023, 5, 1)
+    return [{
+        "_id": ObjectId(),
+        "first_name": "John",
+        "last_name": "Doe",
+        "email": f"patient{i}@gmail.com",
+        "category": "heart",
+        "status": "active",
+        "created_date": start + timedelta(minutes=i),
+    } for i in range(count)]
+
+
+def default_pages(docs, params, page_size):
+    for start in range(0, len(docs), page_size):
+        items = [CaseOut(case_id=str(doc["_id"]), **doc) for doc in docs[start:start + page_size]]
+        page = CursorPage.create(items, params, next_="cursor")
+        validated = CursorPage[CaseOut].validate(page.dict())
+        JSONResponse(jsonable_encoder(validated))
+
+
+def fast_pages(docs, params, page_size):
+    for start in range(0, len(docs), page_size):
+        page = CursorPage.create([], params, next_="cursor").dict()
+        page["items"] = [CasesDriver.case_out_dict(doc) for doc in docs[start:start + page_size]]
+        ORJSONResponse(page)
+
+
+def default_stream(docs):
+    for doc in docs:
+        CaseOut(case_id=str(doc["_id"]), **doc).json() + "\n"
+
+
+def fast_stream(docs):
+    for doc in docs:
+        orjson.dumps(CasesDriver.case_out_dict(doc), option=orjson.OPT_APPEND_NEWLINE)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return round(time.perf_counter() - start, 3)
+
+
+def main(args):
+    params = CursorParams(size=args.page_size)
+    results = []
+    for count in args.cases:
+        docs = make_docs(count)
+        results.append({
+            "cases": count,
+            "pages_default_seconds": timed(default_pages, docs, params, args.page_size),
+            "pages_fast_seconds": timed(fast_pages, docs, params, args.page_size),
+            "stream_default_seconds": timed(default_stream, docs),
+            "stream_fast_seconds": timed(fast_stream, docs),
+        })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--page-size", type=int, default=100)
+    main(parser.parse_args())
@@ -0,0 +1,233 @@
+import asyncio
+import logging
+import os
+from contextlib import contextmanager
+
+import orjson
+from fastapi import HTTPException
+from fastapi import status
+from pymongo import ReturnDocument
+from pymongo import errors as mongo_errors
+
+from dependencies.db import case_schema
+
+"""
+Live feed of newly added cases, streamed to organizations as Server-Sent Events.
+
+New cases reach the subscribers of a worker from one of two sources, picked with CASE_FEED_SOURCE:
+    - "change_stream": one change stream on `cases` per worker, which sees inserts made by every worker. Needs a
+      replica set.
+    - "local": `CasesDriver` publishes the cases it inserts, which only reaches subscribers of the same worker.
+    - "auto" (default): the change stream when the deployment supports it, "local" otherwise.
+
+A client that reconnects with the `Last-Event-ID` of the last event it received first gets the cases it missed, then
+the live feed. Case ids cannot be used for this: they are generated before the case is written, so cases are not
+committed in id order. Event ids are instead:
+    - with the change stream, the resume token of the insert. A reconnecting client gets a change stream of its own,
+      started after that token, so it receives every insert committed after it, in commit order. When the token is
+      older than the oplog the missed cases cannot be replayed: the client gets an `event: reset` and has to reload
+      the cases it shows.
+    - with local publishing, a sequence number given to the case just before it is inserted and stored on it (`seq`).
+      Every worker reserves CASE_FEED_SEQUENCE_BLOCK (default: 1000) numbers at a time from the `sequences`
+      collection, so inserts do not all wait on one document. A reconnecting client gets the cases with a higher number
+      from the collection, then the live feed, including cases with a lower number committed after the replay. A case
+      whose insert was still in flight when the client disconnected, with a lower number than the last event received,
+      is only replayed by the change stream, and so are cases numbered by another worker from an earlier block; use
+      local publishing for a single worker and development.
+"""
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_SECONDS = 15
+INSERTS = [{"$match": {"operationType": "insert"}}]
+
+
+class CaseFeed:
+    def __init__(self, collection):
+        self.collection = collection
+        self.sequences = collection.database["sequences"]
+        self.source = os.environ.get("CASE_FEED_SOURCE", "auto")
+        self.queue_size = int(os.environ.get("CASE_FEED_QUEUE_SIZE", 1000))
+        self.sequence_block = int(os.environ.get("CASE_FEED_SEQUENCE_BLOCK", 1000))
+        # the next sequence number to give and the last one of the reserved block
+        self._next_seq = 1
+        self._last_seq = 0
+        self._reserving = asyncio.Lock()
+        self._subscribers = set()
+        self._watcher = None
+
+    async def start(self):
+        """
+        Starts watching the change stream, or settles on local publishing when the deployment has no change streams
+        (a standalone server).
+        """
+        if self.source == "auto":
+            try:
+                hello = await self.collection.database.client.admin.command("hello")
+            except mongo_errors.PyMongoError:
+                hello = {}
+            self.source = "change_stream" if "setName" in hello or hello.get("msg") == "isdbgrid" else "local"
+        if self.source == "change_stream":
+            self._watcher = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._watcher:
+            self._watcher.cancel()
+            self._watcher = None
+
+    async def _watch(self):
+        resume_token = None
+        delay = 1
+        while True:
+            try:
+                async with self.collection.watch(INSERTS, resume_after=resume_token) as stream:
+                    delay = 1
+                    async for change in stream:
+                        resume_token = change["_id"]
+                        self._broadcast(change["_id"]["_data"], change["fullDocument"])
+            except mongo_errors.OperationFailure:
+                # not resumable (e.g. ChangeStreamHistoryLost): start again from now, and disconnect the subscribers
+                # so they resume from their own last event and learn whether it can still be replayed
+                logger.exception("the case feed change stream failed, restarting it from the current time")
+                resume_token = None
+                for queue in list(self._subscribers):
+                    self._disconnect(queue)
+            except mongo_errors.PyMongoError:
+                # the driver already retried once; open a new stream from the last event we saw
+                logger.warning("the case feed change stream was interrupted, resuming it in %s s", delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    async def number(self, case_docs: list):
+        """
+        Stores a sequence number in the case documents (`seq`) before they are inserted, when the cases are published
+        locally. Numbers come from the block reserved by this worker; only the insert that exhausts it waits for the
+        next one.
+        """
+        if self.source == "change_stream" or not case_docs:
+            return
+        if self._last_seq - self._next_seq + 1 < len(case_docs):
+            async with self._reserving:
+                if self._last_seq - self._next_seq + 1 < len(case_docs):
+                    await self._reserve(max(self.sequence_block, len(case_docs)))
+        for case_doc in case_docs:
+            case_doc["seq"] = self._next_seq
+            self._next_seq += 1
+
+    async def _reserve(self, size: int):
+        # the numbers left in the current block are skipped, the feed only needs increasing numbers
+        try:
+            counter = await self.sequences.find_one_and_update(
+                {"_id": "cases"}, {"$inc": {"value": size}}, upsert=True, return_document=ReturnDocument.AFTER,
+            )
+        except mongo_errors.PyMongoError:
+            raise HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self._next_seq = counter["value"] - size + 1
+        self._last_seq = counter["value"]
+
+    def publish(self, case_docs: list):
+        """
+        Sends inserted case documents to the subscribers, unless the change stream already delivers them.
+        """
+        if self.source != "change_stream":
+            for case_doc in case_docs:
+                self._broadcast(str(case_doc["seq"]), case_doc)
+
+    def _broadcast(self, event_id: str, case_doc: dict):
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait((event_id, case_doc))
+            except asyncio.QueueFull:
+                # a subscriber this far behind is disconnected and replays from its Last-Event-ID when it reconnects
+                self._disconnect(queue)
+
+    def _disconnect(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    @contextmanager
+    def _subscribe(self):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        try:
+            yield queue
+        finally:
+            self._subscribers.discard(queue)
+
+    @staticmethod
+    def _event(event_id: str, case_doc: dict, encode) -> str:
+        return f"id: {event_id}\nevent: case\ndata: {encode(case_doc)}\n\n"
+
+    def events(self, encode, last_id: str = None):
+        """
+        Returns the Server-Sent Events for the cases added after the event `last_id`, then for every new case, with a
+        comment line every HEARTBEAT_SECONDS to keep the connection open.
+
+        Args:
+            encode: Turns a case document, in any schema version, into the JSON text of the event.
+            last_id: Id of the last event the client received, if it is reconnecting.
+
+        Raises:
+            HTTPException: If `last_id` is not an id of this feed.
+        """
+        if not last_id:
+            return self._live_events(encode)
+        if self.source == "change_stream":
+            return self._resumed_events(encode, last_id)
+        try:
+            return self._replayed_events(encode, int(last_id))
+        except ValueError:
+            raise HTTPException(detail="invalid last event id", status_code=status.HTTP_400_BAD_REQUEST)
+
+    async def _live(self, queue: asyncio.Queue, encode, replayed=frozenset()):
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if item is None:
+                return
+            event_id, case_doc = item
+            if case_doc["_id"] not in replayed:
+                yield self._event(event_id, case_doc, encode)
+
+    async def _live_events(self, encode):
+        with self._subscribe() as queue:
+            async for event in self._live(queue, encode):
+                yield event
+
+    async def _replayed_events(self, encode, last_seq: int):
+        schema = case_schema.get_schema()
+        with self._subscribe() as queue:
+            replayed = set()
+            try:
+                cursor = self.collection.find(schema.query({"seq": {"$gt": last_seq}})).sort(schema.sort([("seq", 1)]))
+                async for case_doc in cursor:
+                    case_doc = case_schema.decode(case_doc)
+                    replayed.add(case_doc["_id"])
+                    yield self._event(str(case_doc["seq"]), case_doc, encode)
+            except mongo_errors.PyMongoError:
+                raise HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            async for event in self._live(queue, encode, replayed):
+                yield event
+
+    async def _resumed_events(self, encode, resume_token: str):
+        try:
+            async with self.collection.watch(INSERTS, start_after={"_data": resume_token},
+                                             max_await_time_ms=HEARTBEAT_SECONDS * 1000) as stream:
+                while True:
+                    change = await stream.try_next()
+                    if change is None:
+                        yield ": keep-alive\n\n"
+                        continue
+                    yield self._event(change["_id"]["_data"], change["fullDocument"], encode)
+        except mongo_errors.OperationFailure:
+            # the token is invalid or older than the oplog: the cases missed since cannot be replayed
+            data = orjson.dumps({"detail": "the missed cases cannot be replayed, reload the cases"}).decode()
+            yield f"event: reset\ndata: {data}\n\n"
+        except mongo_errors.PyMongoError:
+            # the client reconnects with the id of the last event it received
+            return
@@ -0,0 +1,125 @@
+import os
+
+from dependencies.models.cases import Category
+
+"""
+Storage formats of the documents of the `cases` collection.
+
+Version 1, the original format, stores the fields of `Case` under their own names, plus `search_terms`.
+Version 2 is compact: short keys, integer codes for the category and the known statuses, and a schema version:
+
+    {"_id": ObjectId, "v": 2, "fn": first_name, "ln": last_name, "em": email, "c": category code,
+     "s": status code (or the status itself when it has no code), "d": created_date, "t": search_terms,
+     "q": seq (the feed sequence number, see `case_feed`)}
+
+The drivers keep working with the field names of `Case`: documents are converted with `to_storage()` before they are
+written and with `decode()` after they are read, and queries, sorts and projections are translated with `query()`,
+`sort()` and `projection()`. `decode()` reads every version, whatever CASE_SCHEMA_VERSION (default: 1) selects for
+writes and queries.
+
+Switching to version 2 is not a zero-downtime change: queries use the keys of one version only, and a listing sorted
+across both formats could not use one index, so the app sees either the old or the new cases, never both. Stop the app
+(or every process writing cases), run `python -m dependencies.db.migrations.compact_cases --offline`, which converts the
+existing cases, then start the app again with CASE_SCHEMA_VERSION=2.
+"""
+
+CATEGORY_CODES = {Category.Heart.value: 1, Category.Burn.value: 2, Category.Cancer.value: 3}
+STATUS_CODES = {"active": 1, "closed": 2, "pending": 3}
+
+
+class CaseSchema:
+    def __init__(self, version: int, keys: dict, codes: dict):
+        """
+        Args:
+            version: Schema version, stored in every document from version 2 on.
+            keys: Storage key of every field, fields not listed keep their name.
+            codes: Code of every known value, per coded field.
+        """
+        self.version = version
+        self.keys = keys
+        self.fields = {key: field for field, key in keys.items()}
+        self.codes = codes
+        self.values = {field: {code: value for value, code in codes.items()} for field, codes in codes.items()}
+
+    def key(self, field: str) -> str:
+        return self.keys.get(field, field)
+
+    def encode(self, field: str, value):
+        codes = self.codes.get(field)
+        if codes is None:
+            return value
+        if isinstance(value, list):
+            return [self.encode(field, item) for item in value]
+        return codes.get(value, value)
+
+    def to_storage(self, case: dict) -> dict:
+        doc = {self.key(field): self.encode(field, value) for field, value in case.items()}
+        if self.version > 1:
+            doc["v"] = self.version
+        return doc
+
+    def query(self, query: dict) -> dict:
+        translated = {}
+        for field, condition in query.items():
+            if field in ("$and", "$or", "$nor"):
+                translated[field] = [self.query(clause) for clause in condition]
+            elif isinstance(condition, dict) and condition and all(op.startswith("$") for op in condition):
+                translated[self.key(field)] = {op: self.encode(field, value) for op, value in condition.items()}
+            else:
+                translated[self.key(field)] = self.encode(field, condition)
+        return translated
+
+    def sort(self, sort: list) -> list:
+        return [(self.key(field), direction) for field, direction in sort]
+
+    def projection(self, projection: dict) -> dict:
+        return {self.key(field): value for field, value in projection.items()}
+
+    def logical_fields(self, fields) -> dict:
+        """
+        Returns aggregation expressions giving `fields` under their own names and values, for a `$project` stage
+        reading documents of this version or of version 1.
+        """
+        expressions = {}
+        for field in fields:
+            key = self.key(field)
+            value = f"${field}" if key == field else {"$ifNull": [f"${key}", f"${field}"]}
+            if field in self.values:
+                value = {"$switch": {
+                    "branches": [{"case": {"$eq": [value, code]}, "then": name}
+                                 for code, name in self.values[field].items()],
+                    "default": value,
+                }}
+            expressions[field] = value
+        return expressions
+
+
+SCHEMAS = {
+    1: CaseSchema(1, keys={}, codes={}),
+    2: CaseSchema(2, keys={
+        "first_name": "fn", "last_name": "ln", "email": "em", "category": "c", "status": "s", "created_date": "d",
+        "search_terms": "t", "seq": "q",
+    }, codes={"category": CATEGORY_CODES, "status": STATUS_CODES}),
+}
+
+
+def get_schema() -> CaseSchema:
+    """
+    Returns the schema the drivers write and query with, selected with CASE_SCHEMA_VERSION.
+    """
+    return SCHEMAS[int(os.environ.get("CASE_SCHEMA_VERSION", 1))]
+
+
+def decode(doc: dict) -> dict:
+    """
+    Returns a case document of any version with the field names and values of `Case`.
+    """
+    version = doc.get("v")
+    if version is None:
+        return doc
+    schema = SCHEMAS[version]
+    case = {schema.fields.get(key, key): value for key, value in doc.items() if key != "v"}
+    for field, values in schema.values.items():
+        if field in case:
+            case[field] = values.get(case[field], case[field])
+    return case
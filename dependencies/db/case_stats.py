@@ -0,0 +1,167 @@
+"""
+Case counters maintained on every insert, so dashboards read case totals without scanning the cases collection.
+
+Every counter is one document in `case_counters`:
+    {"_id": "<day>|<field>|<value>", "day": "2023-05-01" or "all", "field": "total"|"category"|"status",
+     "value": "<category or status>", "count": <int>}
+
+The write version of the cases, used for conditional GETs on listings and statistics, is kept next to them and
+updated by the same `bulk_write`:
+    {"_id": "version", "version": <number of cases added>, "modified": <time of the last write>}
+
+`rebuild()` recomputes all of them from the cases collection with one aggregation, for the first deployment or after
+the counters drift. A counter update that fails after its cases were inserted is logged as drift, and the counters
+stay off until they are rebuilt. The rebuild replaces the counters with a snapshot, so counts added while it runs are
+lost: run it from the command line while case intake is paused. The write version is carried over and bumped, so
+conditional GETs see a new version.
+
+Usage:
+    python -m dependencies.db.case_stats --rebuild
+"""
+
+import argparse
+import asyncio
+import logging
+from collections import Counter
+from datetime import date
+from datetime import datetime
+from datetime import timezone
+from typing import Optional
+
+from fastapi import HTTPException
+from fastapi import status
+from pymongo import UpdateOne
+from pymongo import errors as mongo_errors
+
+from dependencies.db.case_schema import get_schema
+from dependencies.db.client import Client
+from dependencies.models import cases
+from dependencies.utils.conditional import WriteVersion
+
+logger = logging.getLogger(__name__)
+
+ALL_DAYS = "all"
+VERSION_ID = "version"
+COUNTED_FIELDS = ["category", "status"]
+
+
+def _counter_keys(case_doc: dict):
+    created_date = case_doc["created_date"]
+    # days are UTC days, as in `rebuild()` and as MongoDB stores the dates
+    if created_date.tzinfo:
+        created_date = created_date.astimezone(timezone.utc)
+    day = created_date.strftime("%Y-%m-%d")
+    pairs = [("total", ALL_DAYS)] + [(field, str(case_doc[field])) for field in COUNTED_FIELDS]
+    for bucket in (ALL_DAYS, day):
+        for field, value in pairs:
+            yield bucket, field, value
+
+
+class CaseStatsDriver:
+    def __init__(self):
+        self.db = Client.get_instance().get_db()
+        self.collection = self.db["case_counters"]
+        # statistics tolerate replication lag, see `Client.get_secondary_db()`
+        self.secondary_collection = Client.get_instance().get_secondary_db()["case_counters"]
+
+    @staticmethod
+    def _version_update(count: int) -> UpdateOne:
+        return UpdateOne({"_id": VERSION_ID}, {"$inc": {"version": count}, "$currentDate": {"modified": True}},
+                         upsert=True)
+
+    async def increment(self, case_docs: list, session=None):
+        """
+        Adds the case documents to the counters and to the write version with one `bulk_write`.
+        """
+        if not case_docs:
+            return
+        counts = Counter(key for case_doc in case_docs for key in _counter_keys(case_doc))
+        try:
+            await self.collection.bulk_write([
+                UpdateOne(
+                    {"_id": f"{day}|{field}|{value}"},
+                    {"$inc": {"count": count}, "$setOnInsert": {"day": day, "field": field, "value": value}},
+                    upsert=True,
+                )
+                for (day, field, value), count in counts.items()
+            ] + [self._version_update(len(case_docs))], ordered=False, session=session)
+        except mongo_errors.PyMongoError:
+            raise HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    async def get_version(self, session=None) -> WriteVersion:
+        """
+        Returns the write version of the cases, which changes on every insert, for conditional GETs. It is read on the
+        primary, so every request sees the same version whichever member serves its other reads; reads made after it
+        in the same `Client.read_session()` include at least the writes it counts.
+        """
+        try:
+            doc = await self.collection.find_one({"_id": VERSION_ID}, session=session)
+        except mongo_errors.PyMongoError:
+            raise HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return (doc["version"], doc["modified"]) if doc else (0, None)
+
+    async def get_stats(self, start: Optional[date] = None, end: Optional[date] = None,
+                        session=None) -> cases.CaseStats:
+        day_filter = {"$ne": ALL_DAYS}
+        if start:
+            day_filter["$gte"] = start.isoformat()
+        if end:
+            day_filter["$lte"] = end.isoformat()
+        try:
+            totals = await self.secondary_collection.find({"day": ALL_DAYS}, session=session).to_list(length=None)
+            days = await self.secondary_collection.find({"field": "total", "day": day_filter},
+                                                        session=session).to_list(length=None)
+        except mongo_errors.PyMongoError:
+            raise HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        stats = cases.CaseStats()
+        for counter in totals:
+            if counter["field"] == "total":
+                stats.total = counter["count"]
+            else:
+                getattr(stats, f"by_{counter['field']}")[counter["value"]] = counter["count"]
+        stats.by_day = {counter["day"]: counter["count"] for counter in sorted(days, key=lambda c: c["day"])}
+        return stats
+
+    async def rebuild(self):
+        """
+        Replaces every counter with totals aggregated from the cases collection, and bumps the write version. The
+        version document is written by the same `$out`, so it is never missing while the counters are replaced.
+        """
+        pairs = [{"field": "total", "value": ALL_DAYS}] + [
+            {"field": field, "value": {"$toString": {"$ifNull": [f"${field}", ""]}}} for field in COUNTED_FIELDS
+        ]
+        await self.db["cases"].aggregate([
+            {"$project": get_schema().logical_fields(["created_date", *COUNTED_FIELDS])},
+            {"$project": {"day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_date"}}, "pairs": pairs}},
+            {"$unwind": "$pairs"},
+            {"$project": {"keys": [
+                {"day": ALL_DAYS, "field": "$pairs.field", "value": "$pairs.value"},
+                {"day": "$day", "field": "$pairs.field", "value": "$pairs.value"},
+            ]}},
+            {"$unwind": "$keys"},
+            {"$group": {"_id": "$keys", "count": {"$sum": 1}}},
+            {"$project": {
+                "_id": {"$concat": ["$_id.day", "|", "$_id.field", "|", "$_id.value"]},
+                "day": "$_id.day",
+                "field": "$_id.field",
+                "value": "$_id.value",
+                "count": 1,
+            }},
+            {"$unionWith": {"coll": "case_counters", "pipeline": [
+                {"$match": {"_id": VERSION_ID}},
+                {"$set": {"version": {"$add": ["$version", 1]}, "modified": "$$NOW"}},
+            ]}},
+            {"$out": "case_counters"},
+        ]).to_list(length=None)
+        # a first rebuild has no version to carry over
+        await self.collection.update_one(
+            {"_id": VERSION_ID}, {"$setOnInsert": {"version": 1, "modified": datetime.utcnow()}}, upsert=True,
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rebuild", action="store_true", help="recompute every counter from the cases collection")
+    if parser.parse_args().rebuild:
+        asyncio.run(CaseStatsDriver().rebuild())
@@ -1,36 +1,432 @@
+import logging
+import os
+from datetime import datetime
+from datetime import time
+from datetime import timedelta
+from datetime import timezone
+
+import orjson
 import pydantic
+from fastapi_pagination.cursor import CursorPage
+from fastapi_pagination.cursor import CursorParams
 
 from dependencies.models import cases
+from dependencies.db import case_schema
 from dependencies.db.client import Client
+from dependencies.db.case_stats import CaseStatsDriver
+from dependencies.db.case_feed import CaseFeed
+from dependencies.db.write_batcher import WriteBatcher
 from pymongo import errors as mongo_errors
 from bson.objectid import ObjectId
 from dependencies.utils.bson import convert_to_object_id
+from dependencies.utils.cache import PageCache
+from dependencies.utils.conditional import WriteVersion
+from dependencies.utils.search import case_terms
+from dependencies.utils.search import query_terms
 from fastapi import HTTPException
 from fastapi import status
 
+logger = logging.getLogger(__name__)
+
 
 class CasesDriver:
-    def __init__(self):
+    # a search ranks at most this many matching cases, so its cost does not grow with the collection
+    search_candidates = int(os.environ.get("SEARCH_CANDIDATES", 1000))
+
+    def __init__(self, users_driver=None):
+        """
+        Args:
+            users_driver: The `UsersDriver` holding the patients, needed to add cases with `add_case` or `store_cases`.
+        """
         self.db = Client().get_instance().get_db()
         self.collection = self.db["cases"]
+        # documents are written in this format and queries use its keys, see `case_schema`
+        self.schema = case_schema.get_schema()
+        # listings, streams and searches tolerate replication lag, see `Client.get_secondary_db()`
+        self.secondary_collection = Client.get_instance().get_secondary_db()["cases"]
+        self.stats = CaseStatsDriver()
+        self.feed = CaseFeed(self.collection)
+        self.page_cache = PageCache(int(os.environ.get("PAGE_CACHE_SIZE", 0)))
+        self.users_driver = users_driver
+        self.add_batcher = WriteBatcher("cases_add", self._flush_adds)
+
+    async def get_version(self, session=None) -> WriteVersion:
+        """
+        Returns the write version of the cases, which changes on every insert, for conditional GETs on listings.
+        """
+        return await self.stats.get_version(session)
 
-    def add_case(self, case):
+    def read_session(self):
+        """
+        Session for reading the write version and then the page it versions, see `Client.read_session()`.
+        """
+        return Client.get_instance().read_session()
+
+    async def _after_insert(self, case_docs: list):
+        """
+        Counts the stored cases and publishes them, once they are committed. The counters are updated outside the
+        transaction of the cases: they are the same few documents for every case, so concurrent transactions writing
+        them would conflict with each other. The cases are already stored when this runs, so a failure to count them is
+        logged as drift, to be repaired by rebuilding the counters, rather than returned to the client, which would
+        retry and add the cases twice.
+        """
+        self.page_cache.invalidate()
         try:
-            case_dict = case.dict()
-            inserted_id = self.collection.insert_one(case_dict).inserted_id
+            await self.stats.increment(case_docs)
+        except HTTPException:
+            logger.exception("%d inserted cases were not counted, the case counters drifted: rebuild them with "
+                             "`python -m dependencies.db.case_stats --rebuild`", len(case_docs))
+        self.feed.publish(case_docs)
+
+    @staticmethod
+    def case_ref(case: cases.Case, case_id: ObjectId) -> dict:
+        """
+        Returns the summary of a case that is pushed into the cases of its user(patient).
+        """
+        return {
+            "case_id": str(case_id),
+            "category": case.category,
+            "status": case.status,
+            "severity": 1
+        }
+
+    async def add_case(self, case: cases.Case) -> cases.CaseOut:
+        """
+        Stores the case of a user(patient), pushes its summary into the cases of the patient and builds the `CaseOut`
+        from the data, without reading the document back.
 
-            # Retrieve the inserted document to get the case_id
-            inserted_doc = self.collection.find_one({"_id": inserted_id})
-            case_db = cases.CaseOut(case_id=str(inserted_id), **inserted_doc)
-            return case_db
+        The summary is pushed first, with a conditional `$push` that also checks that the patient exists, then the case
+        is inserted. In a transaction (see `Client.run_in_transaction()`) the summary and the case are written together;
+        otherwise a summary whose case could not be inserted is pulled out again. The counters are updated once the case
+        is stored, see `_after_insert`. When write batching is on,
+        cases added outside a transaction are stored with the cases added by concurrent requests instead, like the
+        cases of a bulk request, see `store_cases` and `WriteBatcher`.
+
+        Raises:
+            HTTPException: If no user has the email of the case, or the case could not be stored.
+        """
+        client = Client.get_instance()
+        try:
+            if self.add_batcher.enabled and not client.transactions:
+                case_id = await self.add_batcher.submit(case)
+            else:
+                case_doc = await client.run_in_transaction(lambda session: self._store_case(case, session))
+                await self._after_insert([case_doc])
+                case_id = case_doc["_id"]
+            return cases.CaseOut(case_id=str(case_id), **case.dict())
         except mongo_errors.PyMongoError:
             raise HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
         except pydantic.ValidationError as e:
             raise HTTPException(detail="validation error", status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
                                 headers={"X-Error": str(e)})
 
-    def display_cases(self):
-        res = []
-        for case in self.collection:
-            res.append(case)
-        return res
+    async def _store_case(self, case: cases.Case, session=None) -> dict:
+        case_id = ObjectId()
+        await self.users_driver.add_case_ref(case.email, self.case_ref(case, case_id), session=session)
+        case_doc = {"_id": case_id, **case.dict()}
+        case_doc["search_terms"] = self.search_terms(case_doc)
+        try:
+            await self.feed.number([case_doc])
+            await self.collection.insert_one(self.schema.to_storage(case_doc), session=session)
+        except (mongo_errors.PyMongoError, HTTPException):
+            if session is None:
+                await self._remove_case_ref(case.email, case_id)
+            raise
+        return case_doc
+
+    async def _remove_case_ref(self, email: str, case_id: ObjectId):
+        try:
+            await self.users_driver.remove_case_ref(email, str(case_id))
+        except HTTPException:
+            logger.exception("the summary of the case %s was pushed into its patient but the case was not stored",
+                             case_id)
+
+    @staticmethod
+    def _add_error(error: str) -> HTTPException:
+        if error == "email not found":
+            return HTTPException(detail=error, status_code=status.HTTP_404_NOT_FOUND)
+        return HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    async def _flush_adds(self, new_cases: list) -> list:
+        return [case_id if error is None else self._add_error(error)
+                for case_id, error in await self.store_cases(new_cases)]
+
+    async def store_cases(self, new_cases: list) -> list:
+        """
+        Stores cases of users(patients) in bulk: one `$in` lookup for the patient emails, one unordered `insert_many`
+        for the cases of existing patients, then one `bulk_write` pushing their summaries into the patients. The
+        summaries are only pushed once their cases are stored.
+
+        Returns:
+            list: For every case, in order, a (case_id, error) pair: the id of the stored case and None, or None and why
+            it was not stored ("email not found", or "database error" when its insert failed, the error of the insert
+            being logged).
+        """
+        existing_emails = await self.users_driver.existing_emails({case.email for case in new_cases})
+        to_insert = [(position, case, ObjectId()) for position, case in enumerate(new_cases)
+                     if case.email in existing_emails]
+        failed = await self.insert_cases([{"_id": case_id, **case.dict()} for _, case, case_id in to_insert])
+
+        results = [(None, "email not found")] * len(new_cases)
+        refs_by_email = {}
+        for index, (position, case, case_id) in enumerate(to_insert):
+            if index in failed:
+                # the message of the server names the collection, index and key values, so it stays in the logs
+                logger.error("the case %s was not stored: %s", case_id, failed[index])
+                results[position] = (None, "database error")
+                continue
+            results[position] = (case_id, None)
+            refs_by_email.setdefault(case.email, []).append(self.case_ref(case, case_id))
+        try:
+            await self.users_driver.add_case_refs(refs_by_email)
+        except HTTPException:
+            # the cases are stored and listed; failing them would make the clients add them again
+            logger.exception("the summaries of %d stored cases were not pushed into their patients",
+                             len(to_insert) - len(failed))
+        return results
+
+    async def insert_cases(self, case_docs: list) -> dict:
+        """
+        Inserts the case documents, which already carry their `_id` and use the field names of `Case`, in one unordered
+        `insert_many` and adds the inserted ones to the case counters.
+
+        Returns:
+            dict: The position of every document that failed to insert, mapped to the error message.
+        """
+        if not case_docs:
+            return {}
+        for doc in case_docs:
+            if "search_terms" not in doc:
+                doc["search_terms"] = self.search_terms(doc)
+        await self.feed.number(case_docs)
+        try:
+            await self.collection.insert_many([self.schema.to_storage(doc) for doc in case_docs], ordered=False)
+            failed = {}
+        except mongo_errors.BulkWriteError as e:
+            failed = {error["index"]: error["errmsg"] for error in e.details["writeErrors"]}
+        except mongo_errors.PyMongoError:
+            raise HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        await self._after_insert([doc for position, doc in enumerate(case_docs) if position not in failed])
+        return failed
+
+    @staticmethod
+    def search_terms(case: dict) -> list:
+        return case_terms(case.get("first_name"), case.get("last_name"), case.get("email"))
+
+    @staticmethod
+    def encode_cursor(case) -> str:
+        return f"{case['created_date'].isoformat()}|{case['_id']}"
+
+    @staticmethod
+    def decode_cursor(cursor: str, direction: int) -> dict:
+        """
+        Turns a cursor produced by `encode_cursor` into a keyset filter matching the cases that come after it in
+        the (created_date, _id) order, descending when `direction` is -1 and ascending when it is 1.
+        """
+        try:
+            created_date, case_id = cursor.split("|")
+            created_date = datetime.fromisoformat(created_date)
+        except ValueError:
+            raise HTTPException(detail="invalid cursor", status_code=status.HTTP_400_BAD_REQUEST)
+        case_id = convert_to_object_id(case_id)
+        after = "$lt" if direction == -1 else "$gt"
+        return {"$or": [
+            {"created_date": {after: created_date}},
+            {"created_date": created_date, "_id": {after: case_id}},
+        ]}
+
+    @staticmethod
+    def filter_query(filters: cases.CaseFilter) -> dict:
+        query = {}
+        if filters.category:
+            query["category"] = filters.category.value
+        if filters.status:
+            query["status"] = filters.status
+        if filters.email:
+            query["email"] = filters.email
+        if filters.created_from or filters.created_to:
+            query["created_date"] = {}
+            if filters.created_from:
+                query["created_date"]["$gte"] = datetime.combine(filters.created_from, time.min)
+            if filters.created_to:
+                query["created_date"]["$lt"] = datetime.combine(filters.created_to + timedelta(days=1), time.min)
+        return query
+
+    async def _find_page(self, params: CursorParams, filters: cases.CaseFilter, session=None):
+        raw_params = params.to_raw_params()
+        direction = -1 if filters.sort == cases.SortOrder.Newest else 1
+        query = self.filter_query(filters)
+        if raw_params.cursor:
+            query = {"$and": [query, self.decode_cursor(raw_params.cursor, direction)]}
+        try:
+            cursor = self.secondary_collection.find(self.schema.query(query),
+                                                    self.schema.projection({"search_terms": 0}), session=session)
+            cursor = cursor.sort(self.schema.sort([("created_date", direction), ("_id", direction)]))
+            docs = await cursor.limit(raw_params.size + 1).to_list(length=raw_params.size + 1)
+        except mongo_errors.PyMongoError:
+            raise HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        docs = [case_schema.decode(doc) for doc in docs]
+
+        next_cursor = self.encode_cursor(docs[raw_params.size - 1]) if 0 < raw_params.size < len(docs) else None
+        return docs[:raw_params.size], next_cursor
+
+    @staticmethod
+    def case_out_dict(doc: dict) -> dict:
+        """
+        Maps a case document read from the database, in any schema version, to the fields of `CaseOut` without
+        validating it again. Dates are left as datetimes for orjson to encode.
+        """
+        doc = case_schema.decode(doc)
+        out = {field: doc.get(field) for field in cases.Case.__fields__}
+        out["category"] = cases.normalize_category(out["category"])
+        out["case_id"] = str(doc["_id"])
+        return out
+
+    async def display_cases(self, params: CursorParams, filters: cases.CaseFilter,
+                            session=None) -> CursorPage[cases.CaseOut]:
+        docs, next_cursor = await self._find_page(params, filters, session)
+        items = [cases.CaseOut(case_id=str(doc["_id"]), **doc) for doc in docs]
+        return CursorPage.create(items, params, next_=next_cursor)
+
+    async def display_cases_trusted(self, params: CursorParams, filters: cases.CaseFilter, session=None) -> dict:
+        """
+        Same page as `display_cases`, as plain dicts ready for orjson instead of validated `CaseOut` models.
+        """
+        docs, next_cursor = await self._find_page(params, filters, session)
+        page = CursorPage.create([], params, next_=next_cursor).dict()
+        page["items"] = [self.case_out_dict(doc) for doc in docs]
+        return page
+
+    @staticmethod
+    def _search_key(position: tuple) -> tuple:
+        # (term, created_date, _id) positions in the order of the search index: term ascending, then newest first
+        term, created_date, case_id = position
+        return term, -created_date.replace(tzinfo=timezone.utc).timestamp(), -int(str(case_id), 16)
+
+    def _search_position(self, doc: dict, prefix: str, above: str = "") -> tuple:
+        """
+        Returns the first position of a case in the search index among its terms starting with `prefix` and sorting
+        after `above`, or None if it has none.
+        """
+        positions = [(term, doc["created_date"], doc["_id"]) for term in doc["search_terms"]
+                     if term.startswith(prefix) and term > above]
+        return min(positions, key=self._search_key, default=None)
+
+    @staticmethod
+    def decode_search_cursor(cursor: str) -> tuple:
+        try:
+            term, created_date, case_id = cursor.rsplit("|", 2)
+            created_date = datetime.fromisoformat(created_date)
+        except ValueError:
+            raise HTTPException(detail="invalid cursor", status_code=status.HTTP_400_BAD_REQUEST)
+        return term, created_date, convert_to_object_id(case_id)
+
+    async def search_cases(self, query: str, params: CursorParams) -> cases.CaseSearchPage:
+        """
+        Finds the cases whose patient name or email starts with every word of the query, e.g. "jo do" finds John Doe.
+
+        The longest word is looked up with a range scan of the (search_terms, created_date, _id) index, and results
+        come in the order of that index: cases with the word itself as a name or email first, then by the matching
+        name or email in alphabetical order, newest first for the same name. Pages follow a (term, created_date, _id)
+        keyset, and a page examines at most `search_candidates` index entries, so its cost does not grow with the
+        collection. The first page counts the matches among them in `total`; when the limit was reached the count is
+        a lower bound, flagged with `total_is_lower_bound`.
+        """
+        terms = query_terms(query)
+        if not terms:
+            raise HTTPException(detail="empty query", status_code=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        prefix, others = terms[0], terms[1:]
+        # the smallest string after every string starting with the prefix
+        end = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        raw_params = params.to_raw_params()
+        after = self.decode_search_cursor(raw_params.cursor) if raw_params.cursor else None
+        if after:
+            term, created_date, case_id = after
+            scans = [
+                # the rest of the cases with the term of the cursor, then the cases with the following terms
+                ({"search_terms": term, "$or": [
+                    {"created_date": {"$lt": created_date}},
+                    {"created_date": created_date, "_id": {"$lt": case_id}},
+                ]}, [("created_date", -1), ("_id", -1)]),
+                ({"search_terms": {"$elemMatch": {"$gt": term, "$lt": end}}}, None),
+            ]
+        else:
+            scans = [({"search_terms": {"$elemMatch": {"$gte": prefix, "$lt": end}}}, None)]
+        hint = self.schema.sort([("search_terms", 1), ("created_date", -1), ("_id", -1)])
+        docs = []
+        tail = None
+        try:
+            for mongo_query, sort in scans:
+                budget = self.search_candidates - len(docs)
+                if budget <= 0:
+                    break
+                # without a sort, a scan of a multikey index returns each case once, at its first entry in the range
+                cursor = self.secondary_collection.find(self.schema.query(mongo_query)).hint(hint)
+                if sort:
+                    cursor = cursor.sort(self.schema.sort(sort))
+                docs += await cursor.limit(budget).to_list(length=budget)
+                if sort:
+                    tail = len(docs)
+        except mongo_errors.PyMongoError:
+            raise HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        docs = [case_schema.decode(doc) for doc in docs]
+        limited = len(docs) >= self.search_candidates
+
+        matches = []
+        # a case with the term of the cursor and a later term is found by both scans
+        for doc in {doc["_id"]: doc for doc in reversed(docs)}.values():
+            position = self._search_position(doc, prefix)
+            # a case is listed at its first matching term, so one found again under a later term was already listed
+            if position is None or (after and self._search_key(position) <= self._search_key(after)):
+                continue
+            if all(any(term.startswith(other) for term in doc["search_terms"]) for other in others):
+                matches.append((position, doc))
+        matches.sort(key=lambda match: self._search_key(match[0]))
+
+        size = raw_params.size
+        next_position = None
+        if len(matches) > size:
+            next_position = matches[size - 1][0] if size else None
+        elif limited:
+            # the next page goes on with the index entries this one did not examine
+            last = docs[-1]
+            if after and len(docs) == tail:
+                next_position = (after[0], last["created_date"], last["_id"])
+            else:
+                next_position = self._search_position(last, prefix, after[0] if after else "")
+        next_cursor = None
+        if next_position:
+            term, created_date, case_id = next_position
+            next_cursor = f"{term}|{created_date.isoformat()}|{case_id}"
+        items = [cases.CaseOut(case_id=str(doc["_id"]), **doc) for _, doc in matches[:size]]
+        if after:
+            return cases.CaseSearchPage.create(items, params, next_=next_cursor)
+        return cases.CaseSearchPage.create(items, params, next_=next_cursor, total=len(matches),
+                                           total_is_lower_bound=limited)
+
+    async def stream_cases(self, filters: cases.CaseFilter, trusted: bool = False, batch_size: int = 1000):
+        """
+        Yields every matching case as one NDJSON line, reading the Mongo cursor batch by batch so memory use does not
+        depend on the size of the collection. Trusted documents are encoded with orjson without validating them.
+        """
+        direction = -1 if filters.sort == cases.SortOrder.Newest else 1
+        try:
+            cursor = self.secondary_collection.find(self.schema.query(self.filter_query(filters)),
+                                                    self.schema.projection({"search_terms": 0}))
+            cursor = cursor.sort(self.schema.sort([("created_date", direction), ("_id", direction)]))
+            async for doc in cursor.batch_size(batch_size):
+                if trusted:
+                    yield orjson.dumps(self.case_out_dict(doc), option=orjson.OPT_APPEND_NEWLINE)
+                else:
+                    yield cases.CaseOut(case_id=str(doc["_id"]), **case_schema.decode(doc)).json() + "\n"
+        except mongo_errors.PyMongoError:
+            raise HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    def _feed_event_data(self, doc: dict) -> str:
+        return orjson.dumps(self.case_out_dict(doc)).decode()
+
+    def feed_events(self, last_id: str = None):
+        """
+        Server-Sent Events for the cases added after `last_id`, then for every case added while the client listens.
+        """
+        return self.feed.events(self._feed_event_data, last_id)
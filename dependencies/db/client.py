@@ -1,7 +1,12 @@
 import os
+from contextlib import asynccontextmanager
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
 from pymongo import errors as mongo_errors
+from pymongo.read_preferences import SecondaryPreferred
+
+from dependencies.db.pool_monitor import PoolStatsListener
+from dependencies.metrics import MongoCommandListener
 
 from fastapi import HTTPException
 from fastapi import status
@@ -12,7 +17,23 @@ class Client:
     A class for connecting to a MongoDB database.
 
     This class provides a single instance of the database connection that can be accessed by calling the
-    `get_instance()` method.
+    `get_instance()` method. The connection is made through Motor, so every database operation returns an
+    awaitable and never blocks the event loop. No connection is opened until the first operation.
+
+    The connection pool is configured from the environment:
+        - MONGO_MAX_POOL_SIZE / MONGO_MIN_POOL_SIZE: bounds of the pool (default: 100 / 0).
+        - MONGO_WAIT_QUEUE_TIMEOUT_MS: how long an operation waits for a free connection (default: 2000).
+        - MONGO_SERVER_SELECTION_TIMEOUT_MS: how long an operation waits for a reachable server (default: 5000).
+        - MONGO_CONNECT_TIMEOUT_MS / MONGO_SOCKET_TIMEOUT_MS: connect and read timeouts (default: 5000 / 30000).
+
+    Reads that tolerate replication lag use `get_secondary_db()`, configured with:
+        - MONGO_SECONDARY_READS: "1" to send them to secondaries (default: off, every read goes to the primary).
+        - MONGO_MAX_STALENESS_SECONDS: how far behind the primary a secondary may be to serve them (default and
+          minimum allowed by MongoDB: 90). When no secondary qualifies, they go to the primary.
+    Reads that must agree with an earlier read on the primary run in a `read_session()`.
+
+    The instance is not inherited across `fork()`: pymongo clients are not fork-safe, so a forked worker drops the
+    instance of its parent and connects with its own on first use.
     """
 
     _instance = None
@@ -31,26 +52,129 @@ class Client:
             Client()
         return Client._instance
 
-    def __init__(self):
+    def __init__(self, motor_client=None):
         """
         Initializes the `Client` instance by connecting to the MongoDB database.
 
+        Args:
+            motor_client: An already built Motor-compatible client to use instead of connecting to
+                CONNECTION_STRING, e.g. an in-process stand-in for benchmarks.
+
         Raises:
             HTTPException: If there is an error connecting to the database.
         """
         if not Client._instance:
             try:
                 Client._instance = self
-                self.client = MongoClient(os.environ.get("CONNECTION_STRING"))
+                self.pool_listener = PoolStatsListener()
+                self.client = motor_client or AsyncIOMotorClient(
+                    os.environ.get("CONNECTION_STRING"),
+                    maxPoolSize=int(os.environ.get("MONGO_MAX_POOL_SIZE", 100)),
+                    minPoolSize=int(os.environ.get("MONGO_MIN_POOL_SIZE", 0)),
+                    waitQueueTimeoutMS=int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", 2000)),
+                    serverSelectionTimeoutMS=int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000)),
+                    connectTimeoutMS=int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", 5000)),
+                    socketTimeoutMS=int(os.environ.get("MONGO_SOCKET_TIMEOUT_MS", 30000)),
+                    event_listeners=[self.pool_listener, MongoCommandListener()],
+                )
                 self.db = self.client[os.environ.get("DB_NAME")]
+                self.secondary_db = self.db
+                self.secondary_reads = os.environ.get("MONGO_SECONDARY_READS") == "1"
+                self.transactions = os.environ.get("MONGO_TRANSACTIONS") == "1"
+                if self.secondary_reads:
+                    max_staleness = int(os.environ.get("MONGO_MAX_STALENESS_SECONDS", 90))
+                    self.secondary_db = self.db.with_options(
+                        read_preference=SecondaryPreferred(max_staleness=max_staleness)
+                    )
             except mongo_errors.PyMongoError:
                 raise HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @staticmethod
+    def close():
+        """
+        Closes the connection pool of the single instance, if any; the next `get_instance()` call connects again.
+        """
+        if Client._instance:
+            Client._instance.client.close()
+            Client._instance = None
+
+    @staticmethod
+    def _forget_after_fork():
+        # the parent's pool, monitor threads and locks are unusable here; don't close them, they belong to the parent
+        Client._instance = None
+
     def get_db(self):
         """
         Returns the MongoDB database instance.
 
         Returns:
-            Database: The `Database` instance used to interact with the MongoDB database.
+            AsyncIOMotorDatabase: The `AsyncIOMotorDatabase` instance used to interact with the MongoDB database.
         """
         return self.db
+
+    def get_secondary_db(self):
+        """
+        Returns the MongoDB database for reads that may lag behind the latest writes, such as listings and statistics.
+        Reads that must see a write just made by the same flow (e.g. login right after signup) use `get_db()`.
+
+        Returns:
+            AsyncIOMotorDatabase: The database reading from secondaries when MONGO_SECONDARY_READS=1, else the
+            primary database.
+        """
+        return self.secondary_db
+
+    async def ping(self) -> bool:
+        """
+        Returns whether the database answers a `ping` within the server selection timeout.
+        """
+        try:
+            await self.client.admin.command("ping")
+            return True
+        except mongo_errors.PyMongoError:
+            return False
+
+    def get_pool_stats(self) -> dict:
+        """
+        Returns the connection pool statistics collected from pymongo's pool monitoring events.
+        """
+        return self.pool_listener.get_stats()
+
+    @asynccontextmanager
+    async def read_session(self):
+        """
+        Yields a causally consistent session when reads go to secondaries, otherwise None. A read made in it on a
+        secondary waits until that secondary has applied every write seen by the earlier reads of the session, e.g. a
+        listing read after the write version of the cases includes at least the cases counted in that version.
+
+        Usage:
+            async with Client.get_instance().read_session() as session:
+                version = await primary_collection.find_one(query, session=session)
+                docs = await secondary_collection.find(query, session=session).to_list(length=None)
+        """
+        if not self.secondary_reads:
+            yield None
+            return
+        async with await self.client.start_session(causal_consistency=True) as session:
+            yield session
+
+    async def run_in_transaction(self, callback):
+        """
+        Returns `await callback(session)` run in a transaction when `MONGO_TRANSACTIONS=1` (this needs a replica set),
+        otherwise `await callback(None)` so the writes run without a session.
+
+        The transaction goes through `with_transaction`, which runs the callback again when the transaction fails with
+        a transient error, e.g. a write conflict with a concurrent transaction, and retries the commit when its outcome
+        is unknown. The callback must therefore only write in the session, and keep side effects for after it returns.
+
+        Usage:
+            async def insert(session):
+                return await collection.insert_one(doc, session=session)
+            await Client.get_instance().run_in_transaction(insert)
+        """
+        if not self.transactions:
+            return await callback(None)
+        async with await self.client.start_session() as session:
+            return await session.with_transaction(callback)
+
+
+os.register_at_fork(after_in_child=Client._forget_after_fork)
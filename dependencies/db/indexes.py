@@ -0,0 +1,144 @@
+"""
+Index bootstrap and query-plan verification for the collections used by the drivers.
+
+`create_indexes()` is a deployment step, run once before the app starts (or by every worker on start-up with
+CREATE_INDEXES=1, see `dependencies.services`). `check_query_plans()` runs `explain()` on every query the drivers issue
+and fails when one of them would scan the whole collection.
+
+Usage:
+    python -m dependencies.db.indexes            # create the indexes
+    python -m dependencies.db.indexes --check    # create the indexes, then verify every query plan
+"""
+
+import argparse
+import asyncio
+from datetime import datetime
+
+from bson.objectid import ObjectId
+from pymongo import ASCENDING
+from pymongo import DESCENDING
+from pymongo import IndexModel
+
+from dependencies.db.case_schema import CaseSchema
+from dependencies.db.case_schema import get_schema
+from dependencies.db.client import Client
+
+
+INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+    ],
+    "organizations": [
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+    ],
+    "case_counters": [
+        IndexModel([("field", ASCENDING), ("day", ASCENDING)], name="field_day"),
+        IndexModel([("day", ASCENDING)], name="day"),
+    ],
+}
+
+# (name, keys) of the indexes of `cases`, with the field names of `Case`, see `case_indexes()`
+CASE_INDEXES = [
+    ("created_date_id", [("created_date", DESCENDING), ("_id", DESCENDING)]),
+    ("category_created_date_id", [("category", ASCENDING), ("created_date", DESCENDING), ("_id", DESCENDING)]),
+    ("status_created_date_id", [("status", ASCENDING), ("created_date", DESCENDING), ("_id", DESCENDING)]),
+    ("email_created_date_id", [("email", ASCENDING), ("created_date", DESCENDING), ("_id", DESCENDING)]),
+    ("search_terms_created_date_id",
+     [("search_terms", ASCENDING), ("created_date", DESCENDING), ("_id", DESCENDING)]),
+    ("seq", [("seq", ASCENDING)]),
+]
+
+_sample_email = "index-check@example.com"
+_sample_id = ObjectId()
+_sample_date = datetime(2023, 5, 1)
+
+# (collection, filter, sort) for every query issued by the drivers, with the field names of `Case` for `cases`
+DRIVER_QUERIES = [
+    ("users", {"email": _sample_email}, None),
+    ("users", {"_id": _sample_id}, None),
+    ("users", {"email": {"$in": [_sample_email]}}, None),
+    ("organizations", {"email": _sample_email}, None),
+    ("organizations", {"_id": _sample_id}, None),
+    ("cases", {}, [("created_date", DESCENDING), ("_id", DESCENDING)]),
+    ("cases", {"$or": [
+        {"created_date": {"$lt": _sample_date}},
+        {"created_date": _sample_date, "_id": {"$lt": _sample_id}},
+    ]}, [("created_date", DESCENDING), ("_id", DESCENDING)]),
+    ("cases", {"category": "heart"}, [("created_date", DESCENDING), ("_id", DESCENDING)]),
+    ("cases", {"status": "active", "created_date": {"$gte": _sample_date}},
+     [("created_date", ASCENDING), ("_id", ASCENDING)]),
+    ("cases", {"email": _sample_email}, [("created_date", DESCENDING), ("_id", DESCENDING)]),
+    ("cases", {"search_terms": {"$elemMatch": {"$gte": "jo", "$lt": "jp"}}}, None),
+    ("cases", {"search_terms": "john", "$or": [
+        {"created_date": {"$lt": _sample_date}},
+        {"created_date": _sample_date, "_id": {"$lt": _sample_id}},
+    ]}, [("created_date", DESCENDING), ("_id", DESCENDING)]),
+    ("cases", {"seq": {"$gt": 0}}, [("seq", ASCENDING)]),
+    ("case_counters", {"day": "all"}, None),
+    ("case_counters", {"field": "total", "day": {"$ne": "all", "$gte": "2023-05-01"}}, None),
+]
+
+
+class QueryPlanError(Exception):
+    pass
+
+
+def case_indexes(schema: CaseSchema) -> list:
+    """
+    Returns the indexes of `cases` with the keys of the schema. From version 2 on their names end with the version, so
+    they are built next to the indexes of the previous version while the cases are migrated.
+    """
+    suffix = "" if schema.version == 1 else f"_v{schema.version}"
+    return [IndexModel(schema.sort(keys), name=name + suffix) for name, keys in CASE_INDEXES]
+
+
+async def create_indexes(db=None):
+    db = db if db is not None else Client.get_instance().get_db()
+    for collection, indexes in {**INDEXES, "cases": case_indexes(get_schema())}.items():
+        await db[collection].create_indexes(indexes)
+
+
+def _find_stages(plan, stage):
+    if isinstance(plan, dict):
+        if plan.get("stage") == stage:
+            return True
+        return any(_find_stages(value, stage) for value in plan.values())
+    if isinstance(plan, list):
+        return any(_find_stages(value, stage) for value in plan)
+    return False
+
+
+async def check_query_plans(db=None):
+    """
+    Runs `explain()` on every query in `DRIVER_QUERIES`.
+
+    Raises:
+        QueryPlanError: If any of the winning plans contains a COLLSCAN stage.
+    """
+    db = db if db is not None else Client.get_instance().get_db()
+    schema = get_schema()
+    collscans = []
+    for collection, query, sort in DRIVER_QUERIES:
+        if collection == "cases":
+            query, sort = schema.query(query), sort and schema.sort(sort)
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explanation = await cursor.explain()
+        if _find_stages(explanation["queryPlanner"]["winningPlan"], "COLLSCAN"):
+            collscans.append(f"{collection}: filter={query} sort={sort}")
+    if collscans:
+        raise QueryPlanError("queries doing a COLLSCAN:\n" + "\n".join(collscans))
+
+
+async def main(check: bool):
+    await create_indexes()
+    if check:
+        await check_query_plans()
+        print(f"all {len(DRIVER_QUERIES)} driver queries use an index")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--check", action="store_true", help="verify that no driver query does a COLLSCAN")
+    asyncio.run(main(parser.parse_args().check))
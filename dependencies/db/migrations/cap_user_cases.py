@@ -0,0 +1,40 @@
+"""
+Rebuilds the embedded `cases` array of every user from the `cases` collection, keeping only the most recent
+`USER_CASES_LIMIT` summaries so user documents stop growing with the patient's history.
+
+Summaries used to be pushed into the user who called `/cases/add_case` and without a `case_id`, so they are dropped and
+recomputed from the cases whose `email` is the user's email. Run it while case intake is paused.
+
+Usage:
+    python -m dependencies.db.migrations.cap_user_cases
+"""
+
+import asyncio
+
+from dependencies.db.case_schema import get_schema
+from dependencies.db.client import Client
+from dependencies.db.users import UsersDriver
+
+
+async def cap_user_cases(db=None, limit: int = UsersDriver.max_embedded_cases):
+    db = db if db is not None else Client.get_instance().get_db()
+    cleared = await db["users"].update_many({"cases.0": {"$exists": True}}, {"$set": {"cases": []}})
+    schema = get_schema()
+    await db["cases"].aggregate([
+        {"$sort": dict(schema.sort([("created_date", 1), ("_id", 1)]))},
+        {"$project": schema.logical_fields(["email", "category", "status"])},
+        {"$group": {"_id": "$email", "cases": {"$push": {
+            "case_id": {"$toString": "$_id"},
+            "category": "$category",
+            "status": "$status",
+            "severity": 1,
+        }}}},
+        {"$project": {"_id": 0, "email": "$_id", "cases": {"$slice": ["$cases", -limit]}}},
+        {"$merge": {"into": "users", "on": "email", "whenMatched": "merge", "whenNotMatched": "discard"}},
+    ]).to_list(length=None)
+    return cleared.modified_count
+
+
+if __name__ == "__main__":
+    print(f"cleared the embedded cases of {asyncio.run(cap_user_cases())} users and rebuilt them from the cases "
+          f"collection")
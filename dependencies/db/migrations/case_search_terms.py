@@ -0,0 +1,47 @@
+"""
+Adds the `search_terms` used by `/cases/search` to the cases inserted before it existed.
+
+Cases are read in `_id` order, in batches, and only those without terms are updated, so the migration can be stopped
+and run again, including while cases are being added (new cases get their terms on insert).
+
+Usage:
+    python -m dependencies.db.migrations.case_search_terms --batch 1000
+"""
+
+import argparse
+import asyncio
+
+from pymongo import UpdateOne
+
+from dependencies.db import case_schema
+from dependencies.db.case_schema import get_schema
+from dependencies.db.cases import CasesDriver
+from dependencies.db.client import Client
+
+
+async def add_case_search_terms(db=None, batch: int = 1000) -> int:
+    db = db if db is not None else Client.get_instance().get_db()
+    schema = get_schema()
+    updated = 0
+    last_id = None
+    while True:
+        query = {"search_terms": {"$exists": False}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        docs = await db["cases"].find(schema.query(query),
+                                      schema.projection({"v": 1, "first_name": 1, "last_name": 1, "email": 1})) \
+            .sort("_id", 1).limit(batch).to_list(length=batch)
+        if not docs:
+            return updated
+        await db["cases"].bulk_write([UpdateOne(
+            {"_id": doc["_id"]},
+            {"$set": {schema.key("search_terms"): CasesDriver.search_terms(case_schema.decode(doc))}},
+        ) for doc in docs], ordered=False)
+        updated += len(docs)
+        last_id = docs[-1]["_id"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch", type=int, default=1000)
+    print(f"added search terms to {asyncio.run(add_case_search_terms(batch=parser.parse_args().batch))} cases")
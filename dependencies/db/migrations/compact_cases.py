@@ -0,0 +1,176 @@
+"""
+Converts the cases stored in the original format (schema version 1) to the compact format (version 2), see
+`dependencies.db.case_schema`, and reports how much smaller the cases and their indexes got.
+
+The app reads and writes one format at a time, so it has to be stopped while the cases are converted (see
+`case_schema`): the migration refuses to write unless `--offline` confirms that no app process is running, and the app
+is started again with CASE_SCHEMA_VERSION=2 once it is done.
+
+Cases are converted in `_id` order, in batches of `--batch` written with one unordered `bulk_write`. A case is only
+replaced while it is still in the old format, so the migration can be stopped and run again. Dates stored as text are
+converted to dates; a case whose date cannot be read is left in the old format and counted in the report with its id,
+to be fixed by hand before running the migration again. Categories and statuses that match a code whatever their case
+("Heart") are stored with that code, the others are kept as text and counted in the report.
+
+The report gives the BSON size of the converted cases before and after, and the `collStats` of `cases` before and
+after: data size, storage size, index size and average document size. A listing reads whole documents, so the
+average document size and the index size give the reduction of the working set. `--dry-run` converts the cases in
+memory and reports the BSON sizes without writing anything.
+
+Build the version 2 indexes first, e.g. `CASE_SCHEMA_VERSION=2 python -m dependencies.db.indexes`. Once the app runs
+with CASE_SCHEMA_VERSION=2, drop the version 1 indexes with `--drop-legacy-indexes`.
+
+Usage:
+    python -m dependencies.db.migrations.compact_cases --dry-run --limit 10000
+    python -m dependencies.db.migrations.compact_cases --offline --batch 1000
+    python -m dependencies.db.migrations.compact_cases --drop-legacy-indexes
+"""
+
+import argparse
+import asyncio
+import json
+from collections import Counter
+from datetime import datetime
+from datetime import timezone
+
+import bson
+from pymongo import ReplaceOne
+from pymongo import errors as mongo_errors
+
+from dependencies.db.case_schema import SCHEMAS
+from dependencies.db.cases import CasesDriver
+from dependencies.db.client import Client
+from dependencies.db.indexes import CASE_INDEXES
+
+COLLECTION_STATS = ["count", "size", "avgObjSize", "storageSize", "totalIndexSize"]
+
+
+async def collection_stats(db) -> dict:
+    try:
+        stats = await db.command("collStats", "cases")
+    except mongo_errors.PyMongoError:
+        return {}
+    return {name: stats.get(name) for name in COLLECTION_STATS}
+
+
+def _to_date(value):
+    """
+    Raises:
+        ValueError: If `value` is text that is not an ISO 8601 date.
+    """
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if isinstance(value, datetime) and value.tzinfo:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def compact(doc: dict, uncoded: Counter) -> dict:
+    """
+    Returns the version 2 document of a version 1 case, counting in `uncoded` the values stored without a code.
+
+    Raises:
+        ValueError: If the creation date of the case is text that is not a date.
+    """
+    schema = SCHEMAS[2]
+    case = dict(doc)
+    case["created_date"] = _to_date(case.get("created_date"))
+    if "search_terms" not in case:
+        case["search_terms"] = CasesDriver.search_terms(case)
+    for field, codes in schema.codes.items():
+        if field not in case:
+            continue
+        if isinstance(case[field], str) and case[field].lower() in codes:
+            case[field] = case[field].lower()
+        if case[field] not in codes:
+            uncoded[f"{field}={case[field]}"] += 1
+    return schema.to_storage(case)
+
+
+def _reduction(before, after) -> float:
+    return round(100 * (1 - after / before), 1) if before and after is not None else None
+
+
+async def compact_cases(db=None, batch: int = 1000, dry_run: bool = False, limit: int = None) -> dict:
+    db = db if db is not None else Client.get_instance().get_db()
+    stats_before = await collection_stats(db)
+    examined = converted = bytes_before = bytes_after = 0
+    uncoded = Counter()
+    invalid_dates = []
+    last_id = None
+    while limit is None or examined < limit:
+        query = {"v": {"$exists": False}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        size = batch if limit is None else min(batch, limit - examined)
+        docs = await db["cases"].find(query).sort("_id", 1).limit(size).to_list(length=size)
+        if not docs:
+            break
+        replacements = []
+        for doc in docs:
+            try:
+                compacted = compact(doc, uncoded)
+            except ValueError:
+                invalid_dates.append(str(doc["_id"]))
+                continue
+            bytes_before += len(bson.encode(doc))
+            bytes_after += len(bson.encode(compacted))
+            replacements.append(ReplaceOne({"_id": doc["_id"], "v": {"$exists": False}}, compacted))
+        if replacements and not dry_run:
+            await db["cases"].bulk_write(replacements, ordered=False)
+        examined += len(docs)
+        converted += len(replacements)
+        last_id = docs[-1]["_id"]
+
+    stats_after = stats_before if dry_run else await collection_stats(db)
+    return {
+        "dry_run": dry_run,
+        "converted": converted,
+        "bson_bytes_before": bytes_before,
+        "bson_bytes_after": bytes_after,
+        "bson_reduction_percent": _reduction(bytes_before, bytes_after),
+        "uncoded_values": dict(uncoded),
+        "invalid_dates": len(invalid_dates),
+        "invalid_date_ids": invalid_dates,
+        "collection_before": stats_before,
+        "collection_after": stats_after,
+        "collection_reduction_percent": {
+            name: _reduction(stats_before.get(name), stats_after.get(name))
+            for name in COLLECTION_STATS if name != "count" and stats_before
+        },
+    }
+
+
+async def drop_legacy_indexes(db=None) -> list:
+    db = db if db is not None else Client.get_instance().get_db()
+    dropped = []
+    for name, _ in CASE_INDEXES:
+        try:
+            await db["cases"].drop_index(name)
+            dropped.append(name)
+        except mongo_errors.OperationFailure:
+            pass
+    return dropped
+
+
+async def main(args):
+    if args.drop_legacy_indexes:
+        print(f"dropped the version 1 indexes {await drop_legacy_indexes()}")
+        return
+    report = await compact_cases(batch=args.batch, dry_run=args.dry_run, limit=args.limit)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--limit", type=int, help="convert at most this many cases")
+    parser.add_argument("--dry-run", action="store_true", help="report the size reduction without writing")
+    parser.add_argument("--offline", action="store_true",
+                        help="confirm that the app is stopped, which converting the cases needs")
+    parser.add_argument("--drop-legacy-indexes", action="store_true", help="drop the version 1 indexes of cases")
+    args = parser.parse_args()
+    if not (args.offline or args.dry_run or args.drop_legacy_indexes):
+        parser.error("the app cannot serve cases while they are converted: stop it, then pass --offline to confirm "
+                     "(or --dry-run to only report the size reduction)")
+    asyncio.run(main(args))
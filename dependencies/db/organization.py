@@ -1,3 +1,4 @@
+import os
 from datetime import datetime
 
 import email_validator
@@ -10,47 +11,74 @@ from email_validator import validate_email
 from dependencies.models import users
 from dependencies.db.client import Client
 from dependencies.utils.bson import convert_to_object_id
+from dependencies.utils.cache import ExistenceCache
 
 class OrganizationDriver:
+    exists_cache = ExistenceCache(
+        "organizations:exists",
+        ttl=float(os.environ.get("PRINCIPAL_CACHE_TTL", 60)),
+        negative_ttl=float(os.environ.get("PRINCIPAL_CACHE_NEGATIVE_TTL", 5)),
+    )
+
     def __init__(self):
         self.db = Client.get_instance().get_db()
         self.collection = self.db["organizations"]
 
-    def handle_existing_email(self, email: str):
-        if self.email_exists(email):
+    async def handle_existing_email(self, email: str):
+        if await self.email_exists(email):
             raise HTTPException(detail="email already exists", status_code=status.HTTP_400_BAD_REQUEST)
 
-    def handle_nonexistent_email(self, email: str):
-        if not self.email_exists(email):
+    async def handle_nonexistent_email(self, email: str):
+        if not await self.email_exists(email):
             raise HTTPException(detail="email not found", status_code=status.HTTP_404_NOT_FOUND)
 
-    def create_user(self, user: users.UserInSignup) -> users.UserOut:
+    async def create_user(self, user: users.UserInSignup) -> users.UserOut:
         try:
             org_db = users.OrgDB(last_password_update=datetime.utcnow(), **user.dict())
-            inserted_id = self.collection.insert_one(org_db.dict()).inserted_id
+            inserted_id = (await self.collection.insert_one(org_db.dict())).inserted_id
+            await self.exists_cache.invalidate(str(inserted_id))
             org_out = users.OrgOut(**org_db.dict(), id=str(inserted_id))
             return org_out
         except mongo_errors.PyMongoError:
             raise HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-    def email_exists(self, email: str):
+    async def get_credentials(self, email: str) -> users.UserCredentials:
+        """
+        Returns the id, email and password hash of the account with this email, in the same round-trip that checks
+        the email exists.
+
+        Raises:
+            HTTPException: If no account has this email.
+        """
+        try:
+            user = await self.collection.find_one({"email": email}, {"email": 1, "password": 1})
+        except mongo_errors.PyMongoError:
+            raise HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if user is None:
+            raise HTTPException(detail="email not found", status_code=status.HTTP_404_NOT_FOUND)
+        return users.UserCredentials(id=str(user["_id"]), email=user["email"], password=user["password"])
+
+    async def email_exists(self, email: str):
         try:
-            return self.collection.find_one({"email": email}) is not None
+            return await self.collection.find_one({"email": email}, {"_id": 1}) is not None
         except mongo_errors.PyMongoError:
             raise HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    def get_user_by_email(self, email: str) -> users.OrgOut:
+    async def get_user_by_email(self, email: str) -> users.OrgOut:
         try:
-            user = self.collection.find_one({"email": email})
+            user = await self.collection.find_one({"email": email})
             return users.OrgOut(**user, id=str(user["_id"]))
         except mongo_errors.PyMongoError:
             raise HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    def handle_nonexistent_user(self, user_id: str):
-        if not self.user_exists(user_id):
+    async def handle_nonexistent_user(self, user_id: str):
+        if not await self.user_exists(user_id):
             raise HTTPException(detail="user not found", status_code=status.HTTP_404_NOT_FOUND)
 
-    def user_exists(self, user_id: str) -> bool:
-        user_id = convert_to_object_id(user_id)
-        return self.collection.find_one({"_id": user_id}) is not None
+    async def user_exists(self, user_id: str) -> bool:
+        exists = await self.exists_cache.get(user_id)
+        if exists is None:
+            exists = await self.collection.find_one({"_id": convert_to_object_id(user_id)}, {"_id": 1}) is not None
+            await self.exists_cache.set(user_id, exists)
+        return exists
@@ -0,0 +1,83 @@
+import threading
+import time
+
+from pymongo import monitoring
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """
+    Collects connection pool statistics from pymongo's pool monitoring events.
+
+    Check-out wait times are measured between the check-out started and checked out (or failed) events, which pymongo
+    emits from the thread that runs the operation.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checkout_started = {}
+        self.stats = {
+            "open": 0,
+            "checked_out": 0,
+            "created": 0,
+            "closed": 0,
+            "pool_cleared": 0,
+            "checkouts": 0,
+            "checkout_failed": 0,
+            "checkout_wait_seconds": 0.0,
+            "checkout_wait_max_seconds": 0.0,
+        }
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self.stats)
+
+    def _end_wait(self) -> float:
+        started = self._checkout_started.pop(threading.get_ident(), None)
+        return time.perf_counter() - started if started is not None else 0.0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.stats["pool_cleared"] += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.stats["created"] += 1
+            self.stats["open"] += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.stats["closed"] += 1
+            self.stats["open"] -= 1
+
+    def connection_check_out_started(self, event):
+        with self._lock:
+            self._checkout_started[threading.get_ident()] = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self._end_wait()
+            self.stats["checkout_failed"] += 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            waited = self._end_wait()
+            self.stats["checkouts"] += 1
+            self.stats["checked_out"] += 1
+            self.stats["checkout_wait_seconds"] += waited
+            self.stats["checkout_wait_max_seconds"] = max(self.stats["checkout_wait_max_seconds"], waited)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.stats["checked_out"] -= 1
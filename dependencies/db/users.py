@@ -1,82 +1,118 @@
+import os
 from datetime import datetime
 
 import email_validator
 from fastapi import HTTPException
 from fastapi import status
 
+from pymongo import UpdateOne
 from pymongo import errors as mongo_errors
 from email_validator import validate_email
 
 from dependencies.models import users
 from dependencies.db.client import Client
 from dependencies.utils.bson import convert_to_object_id
+from dependencies.utils.cache import ExistenceCache
 
 class UsersDriver:
+    exists_cache = ExistenceCache(
+        "users:exists",
+        ttl=float(os.environ.get("PRINCIPAL_CACHE_TTL", 60)),
+        negative_ttl=float(os.environ.get("PRINCIPAL_CACHE_NEGATIVE_TTL", 5)),
+    )
+    # only the most recent case summaries are embedded in a user, the full history lives in the cases collection
+    max_embedded_cases = int(os.environ.get("USER_CASES_LIMIT", 50))
+
     def __init__(self):
         self.db = Client.get_instance().get_db()
         self.collection = self.db["users"]
 
-    def handle_existing_email(self, email: str):
-        if self.email_exists(email):
+    async def handle_existing_email(self, email: str):
+        if await self.email_exists(email):
             raise HTTPException(detail="email already exists", status_code=status.HTTP_400_BAD_REQUEST)
 
-    def handle_nonexistent_email(self, email: str):
-        if not self.email_exists(email):
+    async def handle_nonexistent_email(self, email: str):
+        if not await self.email_exists(email):
             raise HTTPException(detail="email not found", status_code=status.HTTP_404_NOT_FOUND)
 
-    def handle_existing_user(self, user_id: str):
-        if self.user_exists(user_id):
+    async def handle_existing_user(self, user_id: str):
+        if await self.user_exists(user_id):
             raise HTTPException(detail="user already exists", status_code=status.HTTP_400_BAD_REQUEST)
 
-    def handle_nonexistent_user(self, user_id: str):
-        if not self.user_exists(user_id):
+    async def handle_nonexistent_user(self, user_id: str):
+        if not await self.user_exists(user_id):
             raise HTTPException(detail="user not found", status_code=status.HTTP_404_NOT_FOUND)
 
-    def user_exists(self, user_id: str) -> bool:
-        user_id = convert_to_object_id(user_id)
-        return self.collection.find_one({"_id": user_id}) is not None
+    async def user_exists(self, user_id: str) -> bool:
+        exists = await self.exists_cache.get(user_id)
+        if exists is None:
+            exists = await self.collection.find_one({"_id": convert_to_object_id(user_id)}, {"_id": 1}) is not None
+            await self.exists_cache.set(user_id, exists)
+        return exists
 
-    def create_user(self, user: users.UserInSignup) -> users.UserOut:
+    async def create_user(self, user: users.UserInSignup) -> users.UserOut:
         try:
             user_db = users.UserDB(last_password_update=datetime.utcnow(), **user.dict())
-            inserted_id = self.collection.insert_one(user_db.dict()).inserted_id
+            inserted_id = (await self.collection.insert_one(user_db.dict())).inserted_id
+            await self.exists_cache.invalidate(str(inserted_id))
             user_out = users.UserOut(**user_db.dict(), id=str(inserted_id))
             return user_out
         except mongo_errors.PyMongoError:
             raise HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    def set_is_verified(self, email: str):
+    async def set_is_verified(self, email: str):
         try:
-            result = self.collection.update_one({"email": email}, {"$set": {"is_verified": True}})
+            result = await self.collection.update_one({"email": email}, {"$set": {"is_verified": True}})
             return result.matched_count == 1 or result.modified_count == 1
         except mongo_errors.PyMongoError:
             raise HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    def get_user_by_email(self, email: str) -> users.UserOut:
+    async def get_user_by_email(self, email: str) -> users.UserOut:
+        """
+        Returns the user with this email, without its embedded cases.
+        """
         try:
-            user = self.collection.find_one({"email": email})
+            user = await self.collection.find_one({"email": email}, {"cases": 0})
             return users.UserOut(**user, id=str(user["_id"]))
         except mongo_errors.PyMongoError:
             raise HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    def email_exists(self, email: str):
+    async def get_credentials(self, email: str) -> users.UserCredentials:
+        """
+        Returns the id, email and password hash of the account with this email, in the same round-trip that checks
+        the email exists.
+
+        Raises:
+            HTTPException: If no account has this email.
+        """
+        try:
+            user = await self.collection.find_one({"email": email}, {"email": 1, "password": 1})
+        except mongo_errors.PyMongoError:
+            raise HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if user is None:
+            raise HTTPException(detail="email not found", status_code=status.HTTP_404_NOT_FOUND)
+        return users.UserCredentials(id=str(user["_id"]), email=user["email"], password=user["password"])
+
+    async def email_exists(self, email: str):
         try:
-            return self.collection.find_one({"email": email}) is not None
+            return await self.collection.find_one({"email": email}, {"_id": 1}) is not None
         except mongo_errors.PyMongoError:
             raise HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    def update_password(self, email: str, password: str):
+    async def update_password(self, email: str, password: str):
         try:
-            return self.collection.update_one(
+            return await self.collection.update_one(
                 {"email": email}, {"$set": {"password": password, "last_password_update": datetime.utcnow()}}
             )
         except mongo_errors.PyMongoError:
             raise HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    def get_user_by_id(self, user_id: str) -> users.UserInfo:
-        self.handle_nonexistent_user(user_id)
+    async def get_user_by_id(self, user_id: str) -> users.UserInfo:
+        await self.handle_nonexistent_user(user_id)
         try:
-            return users.UserInfo(id=user_id, **self.collection.find_one({"_id": convert_to_object_id(user_id)}))
+            return users.UserInfo(id=user_id, **await self.collection.find_one(
+                {"_id": convert_to_object_id(user_id)}, {"email": 1, "firstname": 1, "lastname": 1}
+            ))
         except mongo_errors.PyMongoError:
             raise HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -89,10 +125,61 @@ class UsersDriver:
         except Exception as e:
             raise HTTPException(detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    def edit_info(self, user_id, case_dict):
+    async def edit_info(self, user_id, case_dict):
         try:
             if case_dict is not None:
-                self.collection.update_one({"_id": convert_to_object_id(user_id)}, {"$push": {"cases": case_dict}})
+                await self.collection.update_one({"_id": convert_to_object_id(user_id)},
+                                                 {"$push": {"cases": self._capped([case_dict])}})
+        except mongo_errors.PyMongoError:
+            raise HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    def _capped(self, case_dicts: list) -> dict:
+        return {"$each": case_dicts, "$slice": -self.max_embedded_cases}
+
+    async def add_case_ref(self, email: str, case_dict: dict, session=None):
+        """
+        Pushes a case summary into the cases of the user(patient) with this email, in the same round-trip that checks
+        the email exists.
+
+        Raises:
+            HTTPException: If no user has this email.
+        """
+        try:
+            result = await self.collection.update_one({"email": email}, {"$push": {"cases": self._capped([case_dict])}},
+                                                      session=session)
         except mongo_errors.PyMongoError:
             raise HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if result.matched_count == 0:
+            raise HTTPException(detail="email not found", status_code=status.HTTP_404_NOT_FOUND)
 
+    async def remove_case_ref(self, email: str, case_id: str):
+        """
+        Pulls the summary of a case out of the cases of the user(patient) with this email, e.g. when the case itself
+        could not be stored.
+        """
+        try:
+            await self.collection.update_one({"email": email}, {"$pull": {"cases": {"case_id": case_id}}})
+        except mongo_errors.PyMongoError:
+            raise HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    async def existing_emails(self, emails) -> set:
+        try:
+            cursor = self.collection.find({"email": {"$in": list(emails)}}, {"email": 1, "_id": 0})
+            return {user["email"] async for user in cursor}
+        except mongo_errors.PyMongoError:
+            raise HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    async def add_case_refs(self, refs_by_email: dict):
+        """
+        Pushes case summaries into many users(patients) at once, with one `$push` per email in a single `bulk_write`.
+        """
+        if not refs_by_email:
+            return
+        try:
+            await self.collection.bulk_write(
+                [UpdateOne({"email": email}, {"$push": {"cases": self._capped(refs)}})
+                 for email, refs in refs_by_email.items()],
+                ordered=False,
+            )
+        except mongo_errors.PyMongoError:
+            raise HTTPException(detail="database error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -0,0 +1,151 @@
+import threading
+import time
+from bisect import bisect_left
+
+from pymongo import monitoring
+
+"""
+Latency histograms rendered in the Prometheus text format by `GET /metrics`.
+
+Histograms:
+    - http_request_duration_seconds{method, route, status}: recorded by `MetricsMiddleware`.
+    - mongodb_command_duration_seconds{collection, command}: recorded by `MongoCommandListener`.
+    - password_hash_duration_seconds{operation}: bcrypt time in `PasswordHandler`, without the queue wait.
+    - jwt_duration_seconds{operation}: JWT encoding and decoding in `TokenHandler` (cache hits are not decoded).
+    - mongodb_write_batch_size{batcher}: items per batch written by a `WriteBatcher`.
+    - mongodb_write_batch_wait_seconds{batcher}: time items waited in a `WriteBatcher` before their batch was written.
+
+Recording is a bisect and three additions under a lock; `python -m benchmarks.metrics_overhead` measures it.
+"""
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, label_names: tuple, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # labels -> [count per bucket (the last one is +Inf), sum, count]
+        self._series = {}
+
+    def observe(self, seconds: float, *labels):
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        for labels, counts, total, count in series:
+            label_text = ",".join(f'{name}="{value}"' for name, value in zip(self.label_names, labels))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{label_text}{"," if label_text else ""}le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {count}")
+        return lines
+
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Time to serve a request, by route template", ("method", "route", "status")
+)
+mongodb_command_duration = Histogram(
+    "mongodb_command_duration_seconds", "Time of MongoDB commands reported by the driver", ("collection", "command")
+)
+password_hash_duration = Histogram(
+    "password_hash_duration_seconds", "Time spent in bcrypt", ("operation",)
+)
+jwt_duration = Histogram(
+    "jwt_duration_seconds", "Time spent encoding and decoding JWTs", ("operation",),
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01),
+)
+mongodb_write_batch_size = Histogram(
+    "mongodb_write_batch_size", "Items written per coalesced batch", ("batcher",),
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+mongodb_write_batch_wait = Histogram(
+    "mongodb_write_batch_wait_seconds", "Time an item waited for its coalesced batch to be written", ("batcher",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+
+HISTOGRAMS = [http_request_duration, mongodb_command_duration, password_hash_duration, jwt_duration,
+              mongodb_write_batch_size, mongodb_write_batch_wait]
+
+
+def render(gauges: dict = None) -> str:
+    """
+    Returns every histogram, followed by `gauges` ({name: value}) rendered as untyped samples, in the Prometheus text
+    format.
+    """
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    for name, value in (gauges or {}).items():
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = event.command.get("collection", "")
+        self._collections[(event.request_id, event.connection_id)] = collection
+
+    def _record(self, event):
+        collection = self._collections.pop((event.request_id, event.connection_id), "")
+        mongodb_command_duration.observe(event.duration_micros / 1e6, collection, event.command_name)
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording `http_request_duration_seconds`, labelled with the route template rather than the raw
+    path so ids in the URL do not create new series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = None
+
+    def _route(self, scope) -> str:
+        if self._routes is None:
+            self._routes = {route.endpoint: route.path for route in scope["app"].routes if hasattr(route, "endpoint")}
+        return self._routes.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_request_duration.observe(time.perf_counter() - start, scope["method"], self._route(scope),
+                                          status_code)
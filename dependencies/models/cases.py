@@ -1,8 +1,11 @@
-from typing import Annotated,Optional
+from typing import Annotated,Optional,List,Dict
+from datetime import date
 from datetime import datetime
 
 from pydantic import BaseModel
 from pydantic import Field
+from pydantic import validator
+from fastapi_pagination.cursor import CursorPage
 
 from enum import Enum
 
@@ -41,11 +44,75 @@ class Case(BaseModel):
     first_name: name_type
     last_name: name_type
     email: email_type
-    category: str
+    category: Category_type
     status: str
     created_date: creation_date_type
 
+    class Config:
+        use_enum_values = True
+
+
+def normalize_category(value):
+    """
+    Returns the `Category` value matching a stored category regardless of case (e.g. "Heart" gives "heart"), or the
+    stored value itself when it is not a known category.
+    """
+    if isinstance(value, Category):
+        return value.value
+    if isinstance(value, str) and value.lower() in _category_values:
+        return value.lower()
+    return value
+
+
+_category_values = {category.value for category in Category}
+
 
 class CaseOut(Case):
+    # cases are read back as they were stored, including categories written before they were validated
+    category: str = Field(description="case type in db", example=Category.Heart.value)
     case_id: case_id_type
 
+    @validator("category", pre=True)
+    def known_category(cls, value):
+        return normalize_category(value)
+
+
+class CaseSearchPage(CursorPage[CaseOut]):
+    total_is_lower_bound: bool = Field(False, description="The search stopped counting at its limit, there are at "
+                                                          "least `total` matching cases")
+
+
+class SortOrder(Enum):
+    Newest = "newest"
+    Oldest = "oldest"
+
+
+class CaseFilter(BaseModel):
+    category: Optional[Category] = Field(None, description="Only cases of this category")
+    status: Optional[str] = Field(None, description="Only cases with this status", example="active")
+    email: Optional[str] = Field(None, description="Only cases of the user(patient) with this email")
+    # date ranges are whole UTC days with both bounds included, as `start` and `end` of the statistics
+    created_from: Optional[date] = Field(None, description="Only cases created on or after this day (UTC)",
+                                         example="2023-05-01")
+    created_to: Optional[date] = Field(None, description="Only cases created on or before this day (UTC), included",
+                                       example="2023-05-31")
+    sort: SortOrder = Field(SortOrder.Newest, description="Order of the cases by creation date")
+
+
+class BulkCaseResult(BaseModel):
+    index: int = Field(description="Position of the case in the request")
+    case_id: Optional[case_id_type] = None
+    error: Optional[str] = Field(None, description="Why the case was not added", example="email not found")
+
+
+class BulkCasesOut(BaseModel):
+    inserted: int
+    failed: int
+    results: List[BulkCaseResult]
+
+
+class CaseStats(BaseModel):
+    total: int = Field(0, description="Number of cases")
+    by_category: Dict[str, int] = Field({}, description="Number of cases per category", example={"heart": 12})
+    by_status: Dict[str, int] = Field({}, description="Number of cases per status", example={"active": 9})
+    by_day: Dict[str, int] = Field({}, description="Number of cases created per day", example={"2023-05-01": 3})
@@ -33,7 +33,7 @@ user_id_type = Annotated[str, Field(
     )]
 case_type = Annotated[List[Dict], Field(
         title="Cases List",
-        description="List of cases associated with the user",
+        description="Most recent cases associated with the user, capped at USER_CASES_LIMIT",
     )]
 
 class UserInSignup(BaseModel):
@@ -63,6 +63,11 @@ class UserOutLogin(BaseModel):
     access_token: str
     token_type: str = "bearer"
 
+class UserCredentials(BaseModel):
+    id: user_id_type
+    email: email_type
+    password: password_type
+
 class UserToken(BaseModel):
     id: user_id_type
     email: email_type
@@ -0,0 +1,95 @@
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Annotated
+
+from fastapi import Depends
+from fastapi import FastAPI
+from fastapi import Request
+from pymongo import errors as mongo_errors
+
+from dependencies.db import indexes
+from dependencies.db.cases import CasesDriver
+from dependencies.db.client import Client
+from dependencies.db.organization import OrganizationDriver
+from dependencies.db.users import UsersDriver
+from dependencies.token_handler import TokenHandler
+from dependencies.utils.rate_limit import LoginLimiter
+from routers.auth.password_handler import PasswordHandler
+
+"""
+The drivers and handlers shared by every route.
+
+They are created once per worker by the `lifespan` hook of the app, so importing the app does no database or pool
+setup, and are injected into the routes with the `*Dep` annotations, e.g. `users_driver: UsersDriverDep`.
+
+Starting a worker does not need the database: indexes are created by a deployment step,
+`python -m dependencies.db.indexes`, run once before the workers start. With CREATE_INDEXES=1 every worker also creates
+them on start-up (e.g. for development), and a failure is logged instead of stopping the worker, which then reports
+the database through `/ready`.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class Services:
+    def __init__(self):
+        self.users_driver = UsersDriver()
+        self.org_driver = OrganizationDriver()
+        self.cases_driver = CasesDriver(self.users_driver)
+        self.password_handler = PasswordHandler()
+        self.token_handler = TokenHandler()
+        self.login_limiter = LoginLimiter()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.services = Services()
+    if os.environ.get("CREATE_INDEXES") == "1":
+        try:
+            await indexes.create_indexes()
+            if os.environ.get("CHECK_QUERY_PLANS") == "1":
+                await indexes.check_query_plans()
+        except mongo_errors.PyMongoError:
+            logger.exception("the indexes could not be created, run `python -m dependencies.db.indexes`")
+    await app.state.services.cases_driver.feed.start()
+    yield
+    await app.state.services.cases_driver.feed.stop()
+    app.state.services.password_handler.shutdown()
+    Client.close()
+
+
+def get_services(request: Request) -> Services:
+    return request.app.state.services
+
+
+def get_users_driver(request: Request) -> UsersDriver:
+    return get_services(request).users_driver
+
+
+def get_org_driver(request: Request) -> OrganizationDriver:
+    return get_services(request).org_driver
+
+
+def get_cases_driver(request: Request) -> CasesDriver:
+    return get_services(request).cases_driver
+
+
+def get_password_handler(request: Request) -> PasswordHandler:
+    return get_services(request).password_handler
+
+
+def get_token_handler(request: Request) -> TokenHandler:
+    return get_services(request).token_handler
+
+
+def get_login_limiter(request: Request) -> LoginLimiter:
+    return get_services(request).login_limiter
+
+
+UsersDriverDep = Annotated[UsersDriver, Depends(get_users_driver)]
+OrgDriverDep = Annotated[OrganizationDriver, Depends(get_org_driver)]
+CasesDriverDep = Annotated[CasesDriver, Depends(get_cases_driver)]
+PasswordHandlerDep = Annotated[PasswordHandler, Depends(get_password_handler)]
+TokenHandlerDep = Annotated[TokenHandler, Depends(get_token_handler)]
+LoginLimiterDep = Annotated[LoginLimiter, Depends(get_login_limiter)]
@@ -1,4 +1,6 @@
 import os
+import time
+from collections import OrderedDict
 from datetime import datetime
 from datetime import timedelta
 
@@ -7,17 +9,19 @@ import jwt
 from fastapi import HTTPException
 from fastapi import status
 
+from dependencies import metrics
 from dependencies.models import users
-from dependencies.db import users as users_db
-
-
-users_driver = users_db.UsersDriver()
 
 
 class TokenHandler:
+    # decoded tokens shared by every handler: token -> (UserToken, exp timestamp), least recently used first
+    _cache = OrderedDict()
+    _cache_stats = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+
     def __init__(self):
         self.secret_key = os.environ.get("JWT_SECRET_KEY")
         self.algorithm = "HS256"
+        self.cache_size = int(os.environ.get("TOKEN_CACHE_SIZE", 10000))
 
     def encode_token(self, user: users.UserToken, duration=360):
         expiration_time = datetime.utcnow() + timedelta(hours=duration)
@@ -25,15 +29,31 @@ class TokenHandler:
         payload = {"start": start_time, "exp": expiration_time, "id": user.id, "email": user.email}
 
         try:
-            return jwt.encode(payload, self.secret_key, self.algorithm)
+            start = time.perf_counter()
+            token = jwt.encode(payload, self.secret_key, self.algorithm)
+            metrics.jwt_duration.observe(time.perf_counter() - start, "encode")
+            return token
         except jwt.exceptions.PyJWTError as e:
             raise HTTPException(detail="jwt error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
         except TypeError as e:
             raise HTTPException(detail="type error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     def get_user(self, token) -> users.UserToken:
+        cached = TokenHandler._cache.get(token)
+        if cached is not None:
+            user, expiration = cached
+            if time.time() < expiration:
+                TokenHandler._cache.move_to_end(token)
+                TokenHandler._cache_stats["hits"] += 1
+                return user
+            del TokenHandler._cache[token]
+            TokenHandler._cache_stats["expired"] += 1
+        TokenHandler._cache_stats["misses"] += 1
+
         try:
+            start = time.perf_counter()
             payload = jwt.decode(token, self.secret_key, self.algorithm)
+            metrics.jwt_duration.observe(time.perf_counter() - start, "decode")
             user = users.UserToken(**payload)
             expiration_time = datetime.fromtimestamp(payload["exp"])
             if datetime.utcnow() > expiration_time:
@@ -44,4 +64,16 @@ class TokenHandler:
         except jwt.exceptions.PyJWTError as e:
             raise HTTPException(detail="jwt error", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+        self._cache_user(token, user, payload["exp"])
         return user
+
+    def _cache_user(self, token, user: users.UserToken, expiration: float):
+        if self.cache_size <= 0:
+            return
+        TokenHandler._cache[token] = (user, expiration)
+        while len(TokenHandler._cache) > self.cache_size:
+            TokenHandler._cache.popitem(last=False)
+            TokenHandler._cache_stats["evicted"] += 1
+
+    def get_cache_stats(self):
+        return {**TokenHandler._cache_stats, "size": len(TokenHandler._cache)}
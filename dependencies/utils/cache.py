@@ -0,0 +1,235 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+"""
+Small key/value caches with per-entry expiry, used to keep hot lookups out of MongoDB.
+
+Backends:
+    - MemoryBackend: a bounded in-process dict, one per worker.
+    - SQLiteBackend: a sqlite file on local disk, shared by every worker process on the host.
+
+The backend is picked with CACHE_BACKEND ("memory" by default, or "sqlite"), CACHE_SQLITE_PATH and
+CACHE_SQLITE_PURGE_SECONDS (how often expired rows are deleted, default: 60). Backend calls are awaited.
+
+`PageCache` is separate: it keeps serialized responses in the worker and is invalidated by writes instead of expiring.
+"""
+
+
+class MemoryBackend:
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        self._data = OrderedDict()
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Any, ttl: float):
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    async def delete(self, key: str):
+        self._data.pop(key, None)
+
+    async def take_token(self, key: str, burst: float, rate: float) -> float:
+        """
+        Takes one token from the token bucket `key`, see `TokenBucket`. Nothing is awaited between reading and writing
+        the bucket, so concurrent requests of the worker cannot take the same token.
+        """
+        now = time.time()
+        state = await self.get(key)
+        tokens, updated_at = state if state is not None else (burst, now)
+        tokens = min(burst, tokens + (now - updated_at) * rate)
+        if tokens < 1:
+            return (1 - tokens) / rate
+        await self.set(key, [tokens - 1, now], ttl=burst / rate)
+        return 0
+
+
+class SQLiteBackend:
+    """
+    Runs every statement in one thread of its own, so the event loop never waits on the disk and the connection is
+    never used by two threads at once. Expired rows are deleted every `purge_interval` seconds, on the next write.
+    """
+
+    def __init__(self, path: str, purge_interval: float = 60):
+        self.purge_interval = purge_interval
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-cache")
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS buckets "
+                           "(key TEXT PRIMARY KEY, tokens REAL, updated_at REAL, expires_at REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS buckets_expires_at ON buckets (expires_at)")
+        self._purged_at = time.time()
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def _get(self, key: str) -> Optional[Any]:
+        row = self._conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if time.time() >= row[1]:
+            self._delete(key)
+            return None
+        return json.loads(row[0])
+
+    def _set(self, key: str, value: Any, ttl: float):
+        now = time.time()
+        self._conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)", (key, json.dumps(value), now + ttl))
+        self._purge(now)
+
+    def _purge(self, now: float):
+        if now - self._purged_at >= self.purge_interval:
+            self._purged_at = now
+            self._conn.execute("DELETE FROM cache WHERE expires_at < ?", (now,))
+            self._conn.execute("DELETE FROM buckets WHERE expires_at < ?", (now,))
+
+    def _delete(self, key: str):
+        self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def _take_token(self, key: str, burst: float, rate: float) -> float:
+        now = time.time()
+        # one statement, so the workers sharing the file cannot take the same token; a bucket that has no token left
+        # keeps its row as it is, the others are refilled for the time elapsed and lose one token
+        tokens, updated_at = self._conn.execute(
+            "INSERT INTO buckets VALUES (:key, :burst - 1, :now, :expires_at) "
+            "ON CONFLICT (key) DO UPDATE SET "
+            "tokens = CASE WHEN min(:burst, tokens + (:now - updated_at) * :rate) >= 1 "
+            "THEN min(:burst, tokens + (:now - updated_at) * :rate) - 1 ELSE tokens END, "
+            "updated_at = CASE WHEN min(:burst, tokens + (:now - updated_at) * :rate) >= 1 "
+            "THEN :now ELSE updated_at END, "
+            "expires_at = :expires_at "
+            "RETURNING tokens, updated_at",
+            {"key": key, "burst": burst, "rate": rate, "now": now, "expires_at": now + burst / rate},
+        ).fetchone()
+        self._purge(now)
+        if updated_at == now:
+            return 0
+        return (1 - min(burst, tokens + (now - updated_at) * rate)) / rate
+
+    async def get(self, key: str) -> Optional[Any]:
+        return await self._run(self._get, key)
+
+    async def set(self, key: str, value: Any, ttl: float):
+        await self._run(self._set, key, value, ttl)
+
+    async def delete(self, key: str):
+        await self._run(self._delete, key)
+
+    async def take_token(self, key: str, burst: float, rate: float) -> float:
+        return await self._run(self._take_token, key, burst, rate)
+
+
+_backend = None
+
+
+def get_backend():
+    """
+    Returns the cache backend shared by every cache in this process, creating it from the environment on first use.
+    """
+    global _backend
+    if _backend is None:
+        if os.environ.get("CACHE_BACKEND", "memory") == "sqlite":
+            _backend = SQLiteBackend(os.environ.get("CACHE_SQLITE_PATH", "/tmp/medlinkup-cache.sqlite3"),
+                                     purge_interval=float(os.environ.get("CACHE_SQLITE_PURGE_SECONDS", 60)))
+        else:
+            _backend = MemoryBackend()
+    return _backend
+
+
+def _forget_backend_after_fork():
+    # a sqlite connection must not be used by two processes; the forked one opens its own
+    global _backend
+    _backend = None
+
+
+os.register_at_fork(after_in_child=_forget_backend_after_fork)
+
+
+class ExistenceCache:
+    """
+    Remembers whether an id exists, for `ttl` seconds when it does and `negative_ttl` seconds when it does not.
+    """
+
+    def __init__(self, namespace: str, ttl: float, negative_ttl: float, backend=None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.backend = backend
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    async def get(self, key: str) -> Optional[bool]:
+        return await (self.backend or get_backend()).get(self._key(key))
+
+    async def set(self, key: str, exists: bool):
+        await (self.backend or get_backend()).set(self._key(key), exists, self.ttl if exists else self.negative_ttl)
+
+    async def invalidate(self, key: str):
+        await (self.backend or get_backend()).delete(self._key(key))
+
+
+class PageCache:
+    """
+    Serialized responses for one write version of the data, at most `max_size` of them, the least recently used evicted
+    first. Every page is dropped when a newer version is seen or on `invalidate()`. A `max_size` of 0 disables it.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.version = None
+        self._pages = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "evicted": 0, "invalidated": 0}
+
+    def _check_version(self, version):
+        if version != self.version:
+            self.invalidate()
+            self.version = version
+
+    def get(self, version, key: str) -> Optional[bytes]:
+        if not self.max_size:
+            return None
+        self._check_version(version)
+        body = self._pages.get(key)
+        if body is None:
+            self._stats["misses"] += 1
+            return None
+        self._stats["hits"] += 1
+        self._pages.move_to_end(key)
+        return body
+
+    def set(self, version, key: str, body: bytes):
+        if not self.max_size:
+            return
+        self._check_version(version)
+        self._pages[key] = body
+        while len(self._pages) > self.max_size:
+            self._pages.popitem(last=False)
+            self._stats["evicted"] += 1
+
+    def invalidate(self):
+        if self._pages:
+            self._stats["invalidated"] += 1
+            self._pages.clear()
+
+    def get_stats(self) -> dict:
+        return {"size": len(self._pages), **self._stats}
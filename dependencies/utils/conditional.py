@@ -0,0 +1,66 @@
+from datetime import datetime
+from datetime import timezone
+from email.utils import format_datetime
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Optional, Tuple
+
+from fastapi import Request
+from fastapi import Response
+from fastapi import status
+
+from dependencies.utils.cache import PageCache
+
+"""
+Conditional GET for responses that only change when the data is written to.
+
+The caller passes the write version of the data, a (counter, last write time) pair. It becomes the ETag and the
+Last-Modified header. A request whose If-None-Match (or, without it, If-Modified-Since) still matches gets an empty 304
+and the response is not rendered at all. Otherwise the rendered body is served, from the page cache when given.
+"""
+
+WriteVersion = Tuple[int, Optional[datetime]]
+
+
+def make_etag(version: WriteVersion) -> str:
+    number, modified = version
+    return f'"{number}-{int(modified.timestamp() * 1000)}"' if modified else f'"{number}"'
+
+
+def _not_modified(request: Request, etag: str, modified: Optional[datetime]) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and modified:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo:
+            since = since.astimezone(timezone.utc).replace(tzinfo=None)
+        return modified.replace(microsecond=0) <= since
+    return False
+
+
+async def conditional_response(request: Request, version: WriteVersion, render: Callable[[], Awaitable[bytes]],
+                               cache: PageCache = None, media_type: str = "application/json") -> Response:
+    """
+    Answers a GET with 304 when the client already has this version, else with the body from the cache or `render()`.
+    Pages are cached by path and query string.
+    """
+    etag = make_etag(version)
+    modified = version[1]
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if modified:
+        headers["Last-Modified"] = format_datetime(modified.replace(tzinfo=timezone.utc), usegmt=True)
+    if _not_modified(request, etag, modified):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    key = f"{request.url.path}?{request.url.query}"
+    body = cache.get(version, key) if cache else None
+    if body is None:
+        body = await render()
+        if cache:
+            cache.set(version, key, body)
+    return Response(body, media_type=media_type, headers=headers)
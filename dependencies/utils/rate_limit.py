@@ -0,0 +1,103 @@
+import ipaddress
+import os
+
+from fastapi import HTTPException
+from fastapi import Request
+from fastapi import status
+
+from dependencies.utils.cache import get_backend
+
+"""
+Token-bucket admission control for the login endpoints, applied before the database lookup and bcrypt run.
+
+Every email and every client IP has its own bucket. A bucket holds up to `burst` attempts and refills at
+`per_minute` attempts per minute; an attempt that finds its bucket empty is rejected with 429. Buckets live in the
+cache backend (see dependencies/utils/cache.py), in memory by default or shared by the workers with
+CACHE_BACKEND=sqlite. With the memory backend every worker has its own buckets, so N workers admit up to N times the
+configured attempts; `serve.py` uses the sqlite backend when it runs more than one worker.
+
+Behind a load balancer or an ingress every request comes from the proxy, so the client IP is read from
+X-Forwarded-For, but only through the proxies listed in TRUSTED_PROXIES: the client IP is the right-most address that
+is not a trusted proxy. Without TRUSTED_PROXIES the header is ignored, since any client can set it.
+
+Configuration:
+    - LOGIN_EMAIL_BURST / LOGIN_EMAIL_PER_MINUTE: bucket of every email (default: 5 / 5).
+    - LOGIN_IP_BURST / LOGIN_IP_PER_MINUTE: bucket of every client IP (default: 20 / 60).
+    - TRUSTED_PROXIES: comma-separated addresses or networks of the proxies in front of the app, e.g.
+      "10.0.0.0/8,127.0.0.1" (default: none).
+"""
+
+
+class TokenBucket:
+    def __init__(self, namespace: str, burst: float, per_minute: float, backend=None):
+        self.namespace = namespace
+        self.burst = burst
+        self.rate = per_minute / 60
+        self.backend = backend
+
+    async def take(self, key: str) -> float:
+        """
+        Takes one token from the bucket of `key`.
+
+        Returns:
+            float: 0 if the attempt is admitted, otherwise the number of seconds until a token is available.
+        """
+        return await (self.backend or get_backend()).take_token(f"{self.namespace}:{key}", self.burst, self.rate)
+
+
+class LoginLimiter:
+    _stats = {"admitted": 0, "rejected_email": 0, "rejected_ip": 0}
+
+    def __init__(self):
+        self.ip_bucket = TokenBucket(
+            "login:ip",
+            burst=float(os.environ.get("LOGIN_IP_BURST", 20)),
+            per_minute=float(os.environ.get("LOGIN_IP_PER_MINUTE", 60)),
+        )
+        self.email_bucket = TokenBucket(
+            "login:email",
+            burst=float(os.environ.get("LOGIN_EMAIL_BURST", 5)),
+            per_minute=float(os.environ.get("LOGIN_EMAIL_PER_MINUTE", 5)),
+        )
+        self.trusted_proxies = [ipaddress.ip_network(proxy.strip(), strict=False)
+                                for proxy in os.environ.get("TRUSTED_PROXIES", "").split(",") if proxy.strip()]
+
+    def _is_trusted(self, address: str) -> bool:
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in network for network in self.trusted_proxies)
+
+    def client_ip(self, request: Request) -> str:
+        """
+        Returns the address of the client: the peer address, or when the peer is a trusted proxy, the right-most
+        address of X-Forwarded-For that is not a trusted proxy.
+        """
+        address = request.client.host if request.client else ""
+        if not self._is_trusted(address):
+            return address
+        forwarded = ",".join(request.headers.getlist("x-forwarded-for")).split(",")
+        for hop in reversed([hop.strip() for hop in forwarded if hop.strip()]):
+            address = hop
+            if not self._is_trusted(hop):
+                break
+        return address
+
+    async def check(self, email: str, ip: str):
+        """
+        Admits a login attempt or rejects it when the bucket of the client IP or of the email is empty.
+
+        Raises:
+            HTTPException: If the attempt is rejected, with a Retry-After header.
+        """
+        for bucket, stat, key in ((self.ip_bucket, "rejected_ip", ip), (self.email_bucket, "rejected_email", email)):
+            retry_after = await bucket.take(key.lower())
+            if retry_after:
+                LoginLimiter._stats[stat] += 1
+                raise HTTPException(detail="too many login attempts", status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                                    headers={"Retry-After": str(int(retry_after) + 1)})
+        LoginLimiter._stats["admitted"] += 1
+
+    def get_stats(self):
+        return dict(LoginLimiter._stats)
@@ -0,0 +1,39 @@
+import re
+import unicodedata
+
+"""
+Normalization of patient names and emails for prefix search.
+
+Every case stores the normalized terms of its first name, last name and email in `search_terms`, e.g.
+"Ahmed", "El-Maher", "ahmed.maher@gmail.com" give ["ahmed", "el", "maher", "ahmed.maher@gmail.com"]. Terms are
+lowercased and stripped of accents, so "Hélène" is found with "helene". A query matches a case when each of its terms
+is a prefix of one of the case terms, which a prefix scan of the multikey index on `search_terms` answers.
+"""
+
+_word = re.compile(r"[a-z0-9]+")
+
+
+def normalize(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).lower().strip()
+
+
+def case_terms(first_name: str, last_name: str, email: str) -> list:
+    """
+    Returns the search terms stored with a case: the words of the names and of the local part of the email, and the
+    whole email.
+    """
+    email = normalize(email)
+    words = _word.findall(normalize(first_name)) + _word.findall(normalize(last_name))
+    words += _word.findall(email.split("@")[0])
+    return list(dict.fromkeys(words + [email]))
+
+
+def query_terms(query: str) -> list:
+    """
+    Returns the terms of a search query, longest first. Words containing "@" are kept whole to match emails.
+    """
+    terms = []
+    for word in normalize(query).split():
+        terms.extend([word] if "@" in word else _word.findall(word))
+    return sorted(dict.fromkeys(terms), key=len, reverse=True)
@@ -7,13 +7,16 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi_pagination import add_pagination
 from routers.auth import authentication, organization_authentication
 from routers.cases import cases
+from routers.health import health
+from dependencies.services import lifespan
+from dependencies.metrics import MetricsMiddleware
 
 app = FastAPI(
     title="Cegedim",
     description="Cegedim project APIs",
     version="1.0",
-    docs_url="/"
-
+    docs_url="/",
+    lifespan=lifespan,
 )
 
 
@@ -25,8 +28,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(authentication.router)
 app.include_router(cases.router)
 app.include_router(organization_authentication.router)
+app.include_router(health.router)
 add_pagination(app)
 
@@ -1,6 +1,6 @@
 from typing import Annotated
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
 from fastapi import status
 from fastapi import HTTPException
 from fastapi.responses import PlainTextResponse
@@ -8,18 +8,13 @@ from fastapi.security import OAuth2PasswordBearer
 from fastapi.security import OAuth2PasswordRequestForm
 
 from dependencies.models import users
-from dependencies.db.users import UsersDriver
-from .password_handler import PasswordHandler
-from dependencies.token_handler import TokenHandler
+from dependencies.services import UsersDriverDep, PasswordHandlerDep, TokenHandlerDep, LoginLimiterDep
 
 router = APIRouter(
     prefix="/user-auth",
     tags=["auth"]
 )
 
-password_handler = PasswordHandler()
-token_handler = TokenHandler()
-users_driver = UsersDriver()
 oath2_scheme = OAuth2PasswordBearer(tokenUrl="/user-auth/login")
 
 
@@ -49,10 +44,14 @@ oath2_scheme = OAuth2PasswordBearer(tokenUrl="/user-auth/login")
         }
     }
 )
-async def signup(user: users.UserInSignup) -> PlainTextResponse:
-    users_driver.handle_existing_email(user.email)
-    user.password = password_handler.get_password_hash(user.password)
-    users_driver.create_user(user)
+async def signup(
+        user: users.UserInSignup,
+        users_driver: UsersDriverDep,
+        password_handler: PasswordHandlerDep,
+) -> PlainTextResponse:
+    await users_driver.handle_existing_email(user.email)
+    user.password = await password_handler.get_password_hash(user.password)
+    await users_driver.create_user(user)
     return PlainTextResponse("User is created successfully", status_code=status.HTTP_200_OK)
 
 
@@ -104,6 +103,16 @@ async def signup(user: users.UserInSignup) -> PlainTextResponse:
                 }
             }
         },
+        status.HTTP_429_TOO_MANY_REQUESTS: {
+            "description": "too many login attempts for this email or client",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "detail": "too many login attempts"
+                    }
+                }
+            }
+        },
         status.HTTP_500_INTERNAL_SERVER_ERROR: {
             "description": "wrong domain name",
             "content": {
@@ -116,14 +125,21 @@ async def signup(user: users.UserInSignup) -> PlainTextResponse:
         }
     }
 )
-async def login(user_in: Annotated[OAuth2PasswordRequestForm, Depends()]) -> users.UserOutLogin:
+async def login(
+        request: Request,
+        user_in: Annotated[OAuth2PasswordRequestForm, Depends()],
+        users_driver: UsersDriverDep,
+        password_handler: PasswordHandlerDep,
+        token_handler: TokenHandlerDep,
+        login_limiter: LoginLimiterDep,
+) -> users.UserOutLogin:
+    await login_limiter.check(user_in.username, login_limiter.client_ip(request))
     users_driver.validate(user_in.username)
     user_in = users.UserInLogin(email=user_in.username, password=user_in.password)
 
-    users_driver.handle_nonexistent_email(user_in.email)
-    user_db: users.UserOut = users_driver.get_user_by_email(user_in.email)
+    user_db: users.UserCredentials = await users_driver.get_credentials(user_in.email)
 
-    if not password_handler.verify_password(user_in.password, user_db.password):
+    if not await password_handler.verify_password(user_in.password, user_db.password):
         raise HTTPException(detail="wrong password", status_code=status.HTTP_401_UNAUTHORIZED)
 
     encoded_token = token_handler.encode_token(users.UserToken(**user_db.dict()))
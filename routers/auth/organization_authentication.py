@@ -1,6 +1,6 @@
 from typing import Annotated
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
 from fastapi import status
 from fastapi import HTTPException
 from fastapi.responses import PlainTextResponse
@@ -8,20 +8,13 @@ from fastapi.security import OAuth2PasswordBearer
 from fastapi.security import OAuth2PasswordRequestForm
 
 from dependencies.models import users
-from dependencies.db.users import UsersDriver
-from dependencies.db.organization import OrganizationDriver
-from .password_handler import PasswordHandler
-from dependencies.token_handler import TokenHandler
+from dependencies.services import UsersDriverDep, OrgDriverDep, PasswordHandlerDep, TokenHandlerDep, LoginLimiterDep
 
 router = APIRouter(
     prefix="/org-auth",
     tags=["org-auth"]
 )
 
-password_handler = PasswordHandler()
-token_handler = TokenHandler()
-users_driver = UsersDriver()
-org_driver = OrganizationDriver()
 oath2_scheme = OAuth2PasswordBearer(tokenUrl="/user-auth/login")
 
 
@@ -51,10 +44,14 @@ oath2_scheme = OAuth2PasswordBearer(tokenUrl="/user-auth/login")
         }
     }
 )
-async def signup(org: users.UserInSignup) -> PlainTextResponse:
-    org_driver.handle_existing_email(org.email)
-    org.password = password_handler.get_password_hash(org.password)
-    org_driver.create_user(org)
+async def signup(
+        org: users.UserInSignup,
+        org_driver: OrgDriverDep,
+        password_handler: PasswordHandlerDep,
+) -> PlainTextResponse:
+    await org_driver.handle_existing_email(org.email)
+    org.password = await password_handler.get_password_hash(org.password)
+    await org_driver.create_user(org)
     return PlainTextResponse("organization is created successfully", status_code=status.HTTP_200_OK)
 
 
@@ -107,6 +104,16 @@ async def signup(org: users.UserInSignup) -> PlainTextResponse:
                 }
             }
         },
+        status.HTTP_429_TOO_MANY_REQUESTS: {
+            "description": "too many login attempts for this email or client",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "detail": "too many login attempts"
+                    }
+                }
+            }
+        },
         status.HTTP_500_INTERNAL_SERVER_ERROR: {
             "description": "wrong domain name",
             "content": {
@@ -119,14 +126,22 @@ async def signup(org: users.UserInSignup) -> PlainTextResponse:
         }
     }
 )
-async def login(org_in: Annotated[OAuth2PasswordRequestForm, Depends()]) -> users.UserOutLogin:
+async def login(
+        request: Request,
+        org_in: Annotated[OAuth2PasswordRequestForm, Depends()],
+        users_driver: UsersDriverDep,
+        org_driver: OrgDriverDep,
+        password_handler: PasswordHandlerDep,
+        token_handler: TokenHandlerDep,
+        login_limiter: LoginLimiterDep,
+) -> users.UserOutLogin:
+    await login_limiter.check(org_in.username, login_limiter.client_ip(request))
     users_driver.validate(org_in.username)
     org_in = users.UserInLogin(email=org_in.username, password=org_in.password)
 
-    org_driver.handle_nonexistent_email(org_in.email)
-    org_db: users.OrgOut = org_driver.get_user_by_email(org_in.email)
+    org_db: users.UserCredentials = await org_driver.get_credentials(org_in.email)
 
-    if not password_handler.verify_password(org_in.password, org_db.password):
+    if not await password_handler.verify_password(org_in.password, org_db.password):
         raise HTTPException(detail="wrong password", status_code=status.HTTP_401_UNAUTHORIZED)
 
     encoded_token = token_handler.encode_token(users.UserToken(**org_db.dict()))
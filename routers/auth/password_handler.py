@@ -1,29 +1,128 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+from fastapi import status
 from passlib.context import CryptContext
 
+from dependencies import metrics
+
 """
-This module contains a PasswordHandler class that uses the passlib library to handle password encryption and 
+This module contains a PasswordHandler class that uses the passlib library to handle password encryption and
 verification. The class has two methods: verify_password and get_password_hash.
 
+Hashing is CPU bound (100-300 ms per bcrypt call), so both methods are coroutines that run the work in a worker pool
+shared by every PasswordHandler instance instead of on the event loop. The pool is configured from the environment:
+
+    - PASSWORD_HASH_POOL: "thread" (default) or "process".
+    - PASSWORD_HASH_WORKERS: number of workers, also the number of hashes running at once (default: cpu count / 2).
+    - PASSWORD_HASH_MAX_QUEUE: number of calls allowed to wait for a worker before new ones are rejected with 503
+      (default: 64).
+
 Functions:
     - __init__(): Initializes the class with the necessary instance variables.
-    - verify_password(plain_password: str, hashed_password: str) -> bool: Verifies the provided plain password 
+    - verify_password(plain_password: str, hashed_password: str) -> bool: Verifies the provided plain password
       against a hashed password, returns True if the verification succeeds, False otherwise.
     - get_password_hash(password: str) -> str: Hashes the provided password and returns the resulting hash string.
+    - get_stats() -> dict: Returns the queue depth, in-flight count and latency counters of the pool.
 
 Usage:
-    Create an instance of the PasswordHandler class and use the verify_password and get_password_hash methods to 
-    handle password encryption and verification. The verify_password method takes a plain password and a hashed 
-    password as parameters and returns a Boolean value indicating whether the passwords match. The get_password_hash 
-    method takes a plain password as a parameter and returns a hash string that can be stored in a database or used 
+    Create an instance of the PasswordHandler class and await the verify_password and get_password_hash methods to
+    handle password encryption and verification. The verify_password method takes a plain password and a hashed
+    password as parameters and returns a Boolean value indicating whether the passwords match. The get_password_hash
+    method takes a plain password as a parameter and returns a hash string that can be stored in a database or used
     for password comparison.
 """
 
+_pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def _verify(plain_password, hashed_password):
+    return _pwd_context.verify(plain_password, hashed_password)
+
+
+def _hash(password):
+    return _pwd_context.hash(password)
+
+
 class PasswordHandler:
+    _executor = None
+    _semaphore = None
+    _stats = {"queued": 0, "in_flight": 0, "rejected": 0, "completed": 0, "wait_seconds": 0.0, "run_seconds": 0.0}
+
     def __init__(self):
-        self.pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        self.pwd_context = _pwd_context
+        self.workers = int(os.environ.get("PASSWORD_HASH_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+        self.max_queue = int(os.environ.get("PASSWORD_HASH_MAX_QUEUE", 64))
+        self._start_pool()
+
+    def _start_pool(self):
+        if not PasswordHandler._executor:
+            if os.environ.get("PASSWORD_HASH_POOL", "thread") == "process":
+                PasswordHandler._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                PasswordHandler._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                               thread_name_prefix="password-hash")
+            PasswordHandler._semaphore = asyncio.Semaphore(self.workers)
+
+    async def _run(self, operation, func, *args):
+        self._start_pool()
+        stats = PasswordHandler._stats
+        if stats["queued"] >= self.max_queue:
+            stats["rejected"] += 1
+            raise HTTPException(detail="server busy", status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        queued_at = time.perf_counter()
+        stats["queued"] += 1
+        try:
+            await PasswordHandler._semaphore.acquire()
+        finally:
+            stats["queued"] -= 1
+
+        started_at = time.perf_counter()
+        stats["in_flight"] += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(PasswordHandler._executor, func, *args)
+        finally:
+            run_seconds = time.perf_counter() - started_at
+            stats["in_flight"] -= 1
+            stats["completed"] += 1
+            stats["wait_seconds"] += started_at - queued_at
+            stats["run_seconds"] += run_seconds
+            metrics.password_hash_duration.observe(run_seconds, operation)
+            PasswordHandler._semaphore.release()
+
+    async def verify_password(self, plain_password, hashed_password):
+        return await self._run("verify", _verify, plain_password, hashed_password)
+
+    async def get_password_hash(self, password):
+        return await self._run("hash", _hash, password)
+
+    def shutdown(self):
+        """
+        Stops the worker pool shared by every PasswordHandler; the next handler created starts a new one.
+        """
+        if PasswordHandler._executor:
+            PasswordHandler._executor.shutdown(wait=False, cancel_futures=True)
+            PasswordHandler._executor = None
+            PasswordHandler._semaphore = None
+
+    @staticmethod
+    def _forget_after_fork():
+        # worker threads do not survive fork() and a process pool belongs to the parent; start a new one on first use
+        PasswordHandler._executor = None
+        PasswordHandler._semaphore = None
+        PasswordHandler._stats.update(queued=0, in_flight=0)
+
+    def get_stats(self):
+        stats = dict(PasswordHandler._stats)
+        completed = stats["completed"] or 1
+        stats["avg_wait_seconds"] = stats["wait_seconds"] / completed
+        stats["avg_run_seconds"] = stats["run_seconds"] / completed
+        return stats
 
-    def verify_password(self, plain_password, hashed_password):
-        return self.pwd_context.verify(plain_password, hashed_password)
 
-    def get_password_hash(self, password):
-        return self.pwd_context.hash(password)
+os.register_at_fork(after_in_child=PasswordHandler._forget_after_fork)
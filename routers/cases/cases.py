@@ -1,11 +1,17 @@
-from fastapi.responses import PlainTextResponse
-from typing import List, Annotated
-from fastapi import APIRouter, HTTPException, status, Body
-from dependencies.models.cases import Case, CaseOut
-from dependencies.db.users import UsersDriver
+from fastapi.responses import StreamingResponse
+from fastapi_pagination.cursor import CursorPage
+from fastapi_pagination.cursor import CursorParams
+from typing import Annotated, Optional
+from datetime import date
+import json
+import os
+import orjson
+import pydantic
+from fastapi import APIRouter, HTTPException, status, Body, Request, Header, Query
+from dependencies.models.cases import Case, CaseOut, CaseFilter, CaseSearchPage, BulkCaseResult, BulkCasesOut, CaseStats
 from dependencies.db.cases import CasesDriver
-from dependencies.db.organization import OrganizationDriver
-from dependencies.token_handler import TokenHandler
+from dependencies.services import UsersDriverDep, OrgDriverDep, CasesDriverDep, TokenHandlerDep
+from dependencies.utils.conditional import conditional_response
 from fastapi.security import OAuth2PasswordBearer
 from dependencies.models.users import UserToken
 from fastapi import Depends
@@ -15,11 +21,11 @@ router = APIRouter(
     prefix="/cases",
     tags=["cases"]
 )
-db_handler = CasesDriver()
-users_driver = UsersDriver()
-org_driver = OrganizationDriver()
-token_handler = TokenHandler()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/user-auth/login")
+bulk_chunk_size = int(os.environ.get("BULK_CHUNK_SIZE", 1000))
+# serve listings with orjson straight from the database documents, skipping pydantic validation
+fast_json = os.environ.get("FAST_JSON_RESPONSES") == "1"
+
 
 @router.post(
     "/add_case",
@@ -44,6 +50,9 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/user-auth/login")
 )
 async def add_case(
     token: Annotated[str, Depends(oauth2_scheme)],
+    users_driver: UsersDriverDep,
+    db_handler: CasesDriverDep,
+    token_handler: TokenHandlerDep,
     case: Case = Body(..., description="Case model",
     example={
         "first_name": "John",
@@ -55,36 +64,269 @@ async def add_case(
     })
 ) -> CaseOut:
     user: UserToken = token_handler.get_user(token)
-    users_driver.handle_nonexistent_user(user.id)
-    users_driver.handle_nonexistent_email(case.email)
-    new_case_data = {
-        "category": case.category,
-        "status": case.status,
-        "severity": 1
-    }
-    user_in_db = users_driver.get_user_by_email(case.email)
-    user_in_db.cases.append(new_case_data)
-    users_driver.edit_info(user.id, new_case_data)
-    return db_handler.add_case(case)
+    await users_driver.handle_nonexistent_user(user.id)
+    return await db_handler.add_case(case)
+
+
+async def _ndjson_items(request: Request):
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+
+async def _json_items(request: Request):
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        raise HTTPException(detail="invalid json", status_code=status.HTTP_400_BAD_REQUEST)
+    if not isinstance(body, list):
+        raise HTTPException(detail="expected a JSON array of cases", status_code=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    for item in body:
+        yield item
+
+
+async def _add_cases_chunk(items: list, offset: int, db_handler: CasesDriver) -> list:
+    """
+    Validates and stores one chunk of a bulk request, see `CasesDriver.store_cases`.
+    """
+    results = [BulkCaseResult(index=offset + i) for i in range(len(items))]
+    valid = []
+    for result, item in zip(results, items):
+        try:
+            if isinstance(item, bytes):
+                item = json.loads(item)
+            valid.append((result, Case.parse_obj(item)))
+        except (ValueError, pydantic.ValidationError) as e:
+            result.error = "invalid json" if isinstance(e, json.JSONDecodeError) else "validation error"
+
+    stored = await db_handler.store_cases([case for _, case in valid])
+    for (result, _), (case_id, error) in zip(valid, stored):
+        result.case_id = str(case_id) if case_id else None
+        result.error = error
+    return results
+
+
+@router.post(
+    "/bulk",
+    summary="Add cases in bulk",
+    description="This endpoint allows you to add many cases at once, sent either as a JSON array of cases or as "
+                "newline-delimited JSON (`Content-Type: application/x-ndjson`) with one case per line. "
+                "Every case gets its own result, in the order it was sent",
+    response_model=BulkCasesOut,
+    responses={
+        status.HTTP_200_OK: {
+            "description": "Cases processed, see the result of each case.",
+        },
+        status.HTTP_401_UNAUTHORIZED: {
+            "description": "User is not authorized",
+        },
+    },
+)
+async def add_cases_bulk(
+        request: Request,
+        token: Annotated[str, Depends(oauth2_scheme)],
+        users_driver: UsersDriverDep,
+        db_handler: CasesDriverDep,
+        token_handler: TokenHandlerDep,
+) -> BulkCasesOut:
+    user: UserToken = token_handler.get_user(token)
+    await users_driver.handle_nonexistent_user(user.id)
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        items = _ndjson_items(request)
+    else:
+        items = _json_items(request)
+
+    results = []
+    chunk = []
+    async for item in items:
+        chunk.append(item)
+        if len(chunk) == bulk_chunk_size:
+            results.extend(await _add_cases_chunk(chunk, len(results), db_handler))
+            chunk = []
+    if chunk:
+        results.extend(await _add_cases_chunk(chunk, len(results), db_handler))
+
+    failed = sum(result.error is not None for result in results)
+    return BulkCasesOut(inserted=len(results) - failed, failed=failed, results=results)
 
 @router.get(
     "/display-cases",
     summary="Display cases",
-    description="This endpoint allows you to get all cases of patients",
-    response_model=List[CaseOut],
+    description="This endpoint allows you to get the cases of patients matching the filters, one page at a time. "
+                "Pass the returned `next_page` as `cursor` to get the following page. "
+                "Send the returned `ETag` as `If-None-Match` to get an empty 304 while no case was added",
+    response_model=CursorPage[CaseOut],
     responses={
         status.HTTP_200_OK: {
             "description": "Cases retrieved successfully.",
         },
+        status.HTTP_304_NOT_MODIFIED: {
+            "description": "No case was added since the page with this ETag was served.",
+        },
         status.HTTP_401_UNAUTHORIZED: {
             "description": "User is not authorized",
         },
     }
 )
 async def display_cases(
+        request: Request,
         token: Annotated[str, Depends(oauth2_scheme)],
-        org: UserToken = Depends(token_handler.get_user)
+        params: Annotated[CursorParams, Depends()],
+        filters: Annotated[CaseFilter, Depends()],
+        org_driver: OrgDriverDep,
+        db_handler: CasesDriverDep,
+        token_handler: TokenHandlerDep,
      ):
     org: UserToken = token_handler.get_user(token)
-    org_driver.handle_nonexistent_user(org.id)
-    return db_handler.display_cases()
+    await org_driver.handle_nonexistent_user(org.id)
+
+    # the page is read after the version in one session, so it is never older than its ETag
+    async with db_handler.read_session() as session:
+        async def render() -> bytes:
+            if fast_json:
+                return orjson.dumps(await db_handler.display_cases_trusted(params, filters, session))
+            return (await db_handler.display_cases(params, filters, session)).json(separators=(",", ":")).encode()
+
+        version = await db_handler.get_version(session)
+        return await conditional_response(request, version, render, db_handler.page_cache)
+
+
+@router.get(
+    "/search",
+    summary="Search cases",
+    description="This endpoint finds the cases whose patient first name, last name or email starts with every word "
+                "of `q`, e.g. `jo do` or `john.doe@gm`, ignoring case and accents. Cases where the longest word of `q` "
+                "is a whole name or email come first, then cases by matching name or email in alphabetical order, "
+                "newest first. "
+                "Pass `next_page` as `cursor` for the next page. The first page gives the number of matches in "
+                "`total`, which is only a lower bound when `total_is_lower_bound` is set",
+    response_model=CaseSearchPage,
+    responses={
+        status.HTTP_200_OK: {
+            "description": "Cases found.",
+        },
+        status.HTTP_401_UNAUTHORIZED: {
+            "description": "User is not authorized",
+        },
+        status.HTTP_422_UNPROCESSABLE_ENTITY: {
+            "description": "The query has no word to search for.",
+        },
+    }
+)
+async def search_cases(
+        token: Annotated[str, Depends(oauth2_scheme)],
+        params: Annotated[CursorParams, Depends()],
+        org_driver: OrgDriverDep,
+        db_handler: CasesDriverDep,
+        token_handler: TokenHandlerDep,
+        q: str = Query(..., min_length=1, max_length=200, description="Words to search for", example="john doe"),
+) -> CaseSearchPage:
+    org: UserToken = token_handler.get_user(token)
+    await org_driver.handle_nonexistent_user(org.id)
+    return await db_handler.search_cases(q, params)
+
+
+@router.get(
+    "/display-cases/stream",
+    summary="Stream cases",
+    description="This endpoint streams the cases of patients matching the filters as newline-delimited JSON, "
+                "one case per line",
+    response_class=StreamingResponse,
+    responses={
+        status.HTTP_200_OK: {
+            "description": "Cases streamed successfully.",
+            "content": {"application/x-ndjson": {}},
+        },
+        status.HTTP_401_UNAUTHORIZED: {
+            "description": "User is not authorized",
+        },
+    }
+)
+async def stream_cases(
+        token: Annotated[str, Depends(oauth2_scheme)],
+        filters: Annotated[CaseFilter, Depends()],
+        org_driver: OrgDriverDep,
+        db_handler: CasesDriverDep,
+        token_handler: TokenHandlerDep,
+) -> StreamingResponse:
+    org: UserToken = token_handler.get_user(token)
+    await org_driver.handle_nonexistent_user(org.id)
+    return StreamingResponse(db_handler.stream_cases(filters, trusted=fast_json), media_type="application/x-ndjson")
+
+
+@router.get(
+    "/feed",
+    summary="Live case feed",
+    description="This endpoint pushes every newly added case as a Server-Sent Event (`event: case`). To resume after "
+                "a disconnection, send the id of the last received event as the `Last-Event-ID` header (or the "
+                "`last_id` query parameter) to first receive the cases added since then. An `event: reset` means "
+                "those cases can no longer be replayed: reload the cases, then reconnect without an id",
+    response_class=StreamingResponse,
+    responses={
+        status.HTTP_200_OK: {
+            "description": "Cases streamed as they are added.",
+            "content": {"text/event-stream": {}},
+        },
+        status.HTTP_401_UNAUTHORIZED: {
+            "description": "User is not authorized",
+        },
+    }
+)
+async def case_feed(
+        token: Annotated[str, Depends(oauth2_scheme)],
+        org_driver: OrgDriverDep,
+        db_handler: CasesDriverDep,
+        token_handler: TokenHandlerDep,
+        last_event_id: Annotated[Optional[str], Header()] = None,
+        last_id: Optional[str] = None,
+) -> StreamingResponse:
+    org: UserToken = token_handler.get_user(token)
+    await org_driver.handle_nonexistent_user(org.id)
+    return StreamingResponse(db_handler.feed_events(last_event_id or last_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get(
+    "/stats",
+    summary="Case statistics",
+    description="This endpoint returns the number of cases in total, per category, per status and per creation day. "
+                "Use `start` and `end` to limit the per-day totals to a date range. "
+                "Send the returned `ETag` as `If-None-Match` to get an empty 304 while no case was added",
+    response_model=CaseStats,
+    responses={
+        status.HTTP_200_OK: {
+            "description": "Statistics retrieved successfully.",
+        },
+        status.HTTP_304_NOT_MODIFIED: {
+            "description": "No case was added since the statistics with this ETag were served.",
+        },
+        status.HTTP_401_UNAUTHORIZED: {
+            "description": "User is not authorized",
+        },
+    }
+)
+async def case_stats(
+        request: Request,
+        token: Annotated[str, Depends(oauth2_scheme)],
+        org_driver: OrgDriverDep,
+        db_handler: CasesDriverDep,
+        token_handler: TokenHandlerDep,
+        start: Optional[date] = Query(None, description="Per-day totals from this day (UTC)", example="2023-05-01"),
+        end: Optional[date] = Query(None, description="Per-day totals up to this day (UTC), included",
+                                    example="2023-05-31"),
+):
+    org: UserToken = token_handler.get_user(token)
+    await org_driver.handle_nonexistent_user(org.id)
+
+    async with db_handler.read_session() as session:
+        async def render() -> bytes:
+            return (await db_handler.stats.get_stats(start, end, session)).json(separators=(",", ":")).encode()
+
+        version = await db_handler.get_version(session)
+        return await conditional_response(request, version, render, db_handler.page_cache)
@@ -0,0 +1,65 @@
+from fastapi import APIRouter
+from fastapi import Request
+from fastapi import status
+from fastapi.responses import JSONResponse
+from fastapi.responses import PlainTextResponse
+
+from dependencies import metrics
+from dependencies.db.client import Client
+
+router = APIRouter(
+    tags=["health"]
+)
+
+
+@router.get(
+    "/ready",
+    summary="Readiness probe",
+    description="Reports whether the database is reachable, with the statistics of the connection pool",
+    responses={
+        status.HTTP_200_OK: {
+            "description": "the database is reachable",
+            "content": {
+                "application/json": {
+                    "example": {"status": "ready", "pool": {"open": 2, "checked_out": 0}}
+                }
+            }
+        },
+        status.HTTP_503_SERVICE_UNAVAILABLE: {
+            "description": "the database is not reachable",
+            "content": {
+                "application/json": {
+                    "example": {"status": "unavailable", "pool": {"open": 0, "checked_out": 0}}
+                }
+            }
+        }
+    }
+)
+async def ready() -> JSONResponse:
+    client = Client.get_instance()
+    if await client.ping():
+        return JSONResponse({"status": "ready", "pool": client.get_pool_stats()})
+    return JSONResponse({"status": "unavailable", "pool": client.get_pool_stats()},
+                        status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+@router.get(
+    "/metrics",
+    summary="Prometheus metrics",
+    description="Route, MongoDB command, password hashing and JWT latency histograms, with the counters of the "
+                "password pool, token cache, login limiter, page cache and connection pool, in the Prometheus text "
+                "format",
+    response_class=PlainTextResponse,
+)
+async def get_metrics(request: Request) -> PlainTextResponse:
+    services = request.app.state.services
+    gauges = {}
+    for prefix, stats in (
+        ("password_pool", services.password_handler.get_stats()),
+        ("token_cache", services.token_handler.get_cache_stats()),
+        ("login_limiter", services.login_limiter.get_stats()),
+        ("page_cache", services.cases_driver.page_cache.get_stats()),
+        ("mongodb_pool", Client.get_instance().get_pool_stats()),
+    ):
+        gauges.update({f"{prefix}_{name}": value for name, value in stats.items()})
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4")
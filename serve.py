@@ -0,0 +1,76 @@
+"""
+Runs the API with several worker processes on one host: a gunicorn master supervising uvicorn workers.
+
+Every worker builds its MongoDB client, password pool and caches after it is forked, in the lifespan hook of the app,
+so nothing that holds sockets, threads or locks crosses a fork. With `--preload` the master imports the app once
+before forking, which shortens worker start-up and shares the imported code pages; importing the app opens no
+connection (see `python -m benchmarks.import_time`), so this stays fork-safe.
+
+Settings (command line flag, else environment variable, else default):
+    --workers            WEB_CONCURRENCY              number of CPUs
+    --bind               SERVER_BIND                  0.0.0.0:8000
+    --preload            SERVER_PRELOAD=1             off
+    --graceful-timeout   SERVER_GRACEFUL_TIMEOUT      30 s for a worker to finish its requests on restart or stop
+    --timeout            SERVER_TIMEOUT               30 s without heartbeat before a worker is killed
+    --max-requests       SERVER_MAX_REQUESTS          0 (off), requests served before a worker is replaced
+    --max-requests-jitter SERVER_MAX_REQUESTS_JITTER  0, random extra requests so workers are not replaced together
+
+With more than one worker the login rate limits and caches use the sqlite backend shared by the workers (see
+dependencies/utils/cache.py) unless CACHE_BACKEND is set, otherwise every worker would admit the configured number of
+login attempts on its own.
+
+Graceful restart: `kill -HUP <master pid>` starts new workers and stops the old ones once they finish their requests.
+Without `--preload` the new workers also load new code; with it, restart the master to deploy code.
+
+Usage:
+    CONNECTION_STRING=mongodb://localhost:27017 DB_NAME=medlinkup JWT_SECRET_KEY=... python serve.py --workers 4
+"""
+
+import argparse
+import os
+
+from gunicorn.app.base import BaseApplication
+
+
+class Server(BaseApplication):
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from main import app
+        return app
+
+
+def options_from(args) -> dict:
+    return {
+        "bind": args.bind,
+        "workers": args.workers,
+        "worker_class": "uvicorn.workers.UvicornWorker",
+        "preload_app": args.preload,
+        "graceful_timeout": args.graceful_timeout,
+        "timeout": args.timeout,
+        "max_requests": args.max_requests,
+        "max_requests_jitter": args.max_requests_jitter,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    parser.add_argument("--bind", default=os.environ.get("SERVER_BIND", "0.0.0.0:8000"))
+    parser.add_argument("--preload", action=argparse.BooleanOptionalAction,
+                        default=os.environ.get("SERVER_PRELOAD") == "1")
+    parser.add_argument("--graceful-timeout", type=int, default=int(os.environ.get("SERVER_GRACEFUL_TIMEOUT", 30)))
+    parser.add_argument("--timeout", type=int, default=int(os.environ.get("SERVER_TIMEOUT", 30)))
+    parser.add_argument("--max-requests", type=int, default=int(os.environ.get("SERVER_MAX_REQUESTS", 0)))
+    parser.add_argument("--max-requests-jitter", type=int,
+                        default=int(os.environ.get("SERVER_MAX_REQUESTS_JITTER", 0)))
+    args = parser.parse_args()
+    if args.workers > 1:
+        os.environ.setdefault("CACHE_BACKEND", "sqlite")
+    Server(options_from(args)).run()